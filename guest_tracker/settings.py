@@ -110,6 +110,13 @@ else:
         }
     }
 
+    # import_guests --fast uses LOAD DATA LOCAL INFILE on MySQL when allowed;
+    # the server must also have local_infile enabled
+    if config('DB_ENGINE') == 'django.db.backends.mysql':
+        DATABASES['default']['OPTIONS'] = {
+            'local_infile': config('DB_LOCAL_INFILE', default=False, cast=bool),
+        }
+
     # If using a non-SQLite engine (e.g. MySQL), attempt to install PyMySQL as
     # a drop-in replacement for MySQLdb. If PyMySQL isn't installed locally,
     # defer the ImportError so local SQLite development isn't blocked.
@@ -173,6 +180,39 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@zambiaarmyevents.com')
+# Bulk sends deliver this many emails per SMTP session
+EMAIL_BATCH_SIZE = config('EMAIL_BATCH_SIZE', default=50, cast=int)
+# Concurrent SMTP connections used by bulk sends
+EMAIL_SEND_WORKERS = config('EMAIL_SEND_WORKERS', default=4, cast=int)
+# Provider limits for bulk sends (0 = no limit)
+EMAIL_RATE_PER_SECOND = config('EMAIL_RATE_PER_SECOND', default=5, cast=float)
+EMAIL_RATE_PER_HOUR = config('EMAIL_RATE_PER_HOUR', default=0, cast=int)
+# Retries of a message after a temporary (4xx) rejection or a dropped connection,
+# waiting EMAIL_BACKOFF_SECONDS and doubling each time
+EMAIL_MAX_RETRIES = config('EMAIL_MAX_RETRIES', default=3, cast=int)
+EMAIL_BACKOFF_SECONDS = config('EMAIL_BACKOFF_SECONDS', default=2, cast=float)
+# A running send job with no checkpoint for this many seconds is taken to be
+# dead, and `send_invitations --resume` may take it over
+SEND_JOB_STALE_AFTER = config('SEND_JOB_STALE_AFTER', default=900, cast=int)
+# Count email opens (tracking pixel) and clicks (RSVP link redirect); hits are
+# buffered per process and written by a background thread every
+# TRACKING_FLUSH_INTERVAL seconds, at TRACKING_FLUSH_THRESHOLD hits and on exit
+EMAIL_TRACKING = config('EMAIL_TRACKING', default=True, cast=bool)
+TRACKING_FLUSH_INTERVAL = config('TRACKING_FLUSH_INTERVAL', default=10, cast=float)
+TRACKING_FLUSH_THRESHOLD = config('TRACKING_FLUSH_THRESHOLD', default=1000, cast=int)
+# Site address for links in emails sent outside a web request (commands, workers)
+SITE_URL = config('SITE_URL', default='')
+# RSVP reminders go out this many days before an event's RSVP deadline
+RSVP_REMINDER_DAYS = config('RSVP_REMINDER_DAYS', default='7,2', cast=Csv(cast=int))
+# Embed guests' QR codes in invitation emails unless a send says otherwise
+EMAIL_INCLUDE_QR_CODE = config('EMAIL_INCLUDE_QR_CODE', default=False, cast=bool)
+
+# Background email sending
+# With a broker, send jobs are run by a Celery worker; without one they stay
+# in the database and are sent by `manage.py process_send_jobs`.
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='')
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TIMEZONE = TIME_ZONE
 
 # Login URLs
 LOGIN_URL = '/login/'
@@ -195,11 +235,28 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
-# Static files storage
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# File storages (Django 5 only reads STORAGES, not STATICFILES_STORAGE)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
 
 # QR Code settings
-QR_CODE_CACHE_ALIAS = 'default'
+# Invitation QR codes and barcodes are rendered on demand and kept in this cache
+QR_CODE_CACHE_ALIAS = 'codes'
+CODE_IMAGE_CACHE_DIR = BASE_DIR / config('CODE_IMAGE_CACHE_DIR', default='cache/codes')
+CODE_IMAGE_CACHE_MAX_ENTRIES = config('CODE_IMAGE_CACHE_MAX_ENTRIES', default=50000, cast=int)
+CODE_IMAGE_MAX_AGE = 60 * 60 * 24 * 30  # 30 days
+# Key of barcode check digits, kept apart from SECRET_KEY so rotating that
+# does not void printed tickets. After changing it, list the old value in
+# BARCODE_SECRET_FALLBACKS until the old tickets are no longer needed.
+BARCODE_SECRET = config('BARCODE_SECRET', default=SECRET_KEY)
+BARCODE_SECRET_FALLBACKS = config('BARCODE_SECRET_FALLBACKS', default='', cast=Csv())
+# Default image format for invitation codes: 'png' or 'svg' (vector, print-friendly)
+INVITATION_CODE_FORMAT = config('INVITATION_CODE_FORMAT', default='png')
+# Worker processes of the ticket sheet download; 1 renders in the web process
+# itself. Print large sheets with the print_tickets command instead.
+TICKET_PDF_WORKERS = config('TICKET_PDF_WORKERS', default=1, cast=int)
 
 # Security Settings
 SECURE_SSL_REDIRECT = config('SECURE_SSL_REDIRECT', default=False, cast=bool)
@@ -313,10 +370,18 @@ if USE_S3:
     # S3 Static & Media Settings
     AWS_LOCATION = 'static'
     STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{AWS_LOCATION}/'
-    STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
-    
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
     MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/media/'
+    # Static files and media share the bucket under their own prefixes
+    STORAGES = {
+        'default': {
+            'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+            'OPTIONS': {'location': 'media'},
+        },
+        'staticfiles': {
+            'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+            'OPTIONS': {'location': AWS_LOCATION},
+        },
+    }
 
 # Sentry Configuration (Error Monitoring)
 SENTRY_DSN = config('SENTRY_DSN', default='')
@@ -359,6 +424,26 @@ if REDIS_URL:
         }
     }
 
+# Cache for rendered invitation codes, shared by all workers: Redis when it is
+# configured (give it an LRU maxmemory-policy), else a size-bounded disk cache
+# sharded into subdirectories with least-recently-used culling
+if REDIS_URL:
+    CACHES['codes'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'guest_tracker_codes',
+        'TIMEOUT': None,
+    }
+else:
+    CACHES['codes'] = {
+        'BACKEND': 'guests.cache.ShardedFileCache',
+        'LOCATION': CODE_IMAGE_CACHE_DIR,
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': CODE_IMAGE_CACHE_MAX_ENTRIES,
+        },
+    }
+
 # Google reCAPTCHA Configuration
 RECAPTCHA_PUBLIC_KEY = config('RECAPTCHA_PUBLIC_KEY', default='')
 RECAPTCHA_PRIVATE_KEY = config('RECAPTCHA_PRIVATE_KEY', default='')
@@ -1,10 +1,13 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.html import format_html
 from django.urls import reverse
+from import_export.admin import ImportExportModelAdmin
+from .codes import decode_barcode
 from .models import (
     Event, Guest, Invitation, RSVP, EventCategory, EventTemplate, 
-    GuestProfile, EventAnalytics, EmailTemplate, EventWaitlist
+    GuestProfile, EventAnalytics, EmailTemplate, EventWaitlist, SendJob
 )
+from .resources import GuestResource, InvitationResource
 
 # Set custom admin site headers/titles directly
 admin.site.site_header = "Zambia Army Guest Tracking System Administration"
@@ -57,18 +60,20 @@ class EventAdmin(admin.ModelAdmin):
     rsvp_count.short_description = 'RSVPs Received'
 
 @admin.register(Guest)
-class GuestAdmin(admin.ModelAdmin):
-    list_display = ['full_name', 'email', 'phone', 'created_at']
-    list_filter = ['created_at']
+class GuestAdmin(ImportExportModelAdmin):
+    resource_classes = [GuestResource]
+    list_display = ['full_name', 'email', 'phone', 'created_at', 'email_bounced_at']
+    list_filter = ['created_at', 'email_bounced_at']
     search_fields = ['first_name', 'last_name', 'email']
     readonly_fields = ['created_at']
 
 @admin.register(Invitation)
-class InvitationAdmin(admin.ModelAdmin):
+class InvitationAdmin(ImportExportModelAdmin):
+    resource_classes = [InvitationResource]
     list_display = ['guest', 'event', 'email_sent', 'email_sent_at', 'rsvp_status', 'table_number', 'seat_number', 'checked_in', 'rsvp_link']
     list_filter = ['event', 'email_sent', 'sent_at', 'checked_in', 'table_number']
     search_fields = ['guest__first_name', 'guest__last_name', 'guest__email', 'barcode_number', 'table_number', 'seat_number']
-    readonly_fields = ['unique_code', 'sent_at', 'rsvp_link', 'barcode_number', 'barcode_display', 'qr_display', 'check_in_time']
+    readonly_fields = ['unique_code', 'sent_at', 'rsvp_link', 'barcode', 'barcode_display', 'qr_display', 'check_in_time']
     actions = ['resend_invitations_action']
     list_editable = ['table_number', 'seat_number']
     fieldsets = (
@@ -86,7 +91,7 @@ class InvitationAdmin(admin.ModelAdmin):
             'fields': ('checked_in', 'check_in_time')
         }),
         ('Codes', {
-            'fields': ('barcode_number', 'barcode_display', 'qr_display', 'rsvp_link'),
+            'fields': ('barcode', 'barcode_display', 'qr_display', 'rsvp_link'),
             'classes': ('collapse',)
         }),
         ('Personal Message', {
@@ -96,26 +101,34 @@ class InvitationAdmin(admin.ModelAdmin):
     )
     
     def resend_invitations_action(self, request, queryset):
-        """Admin action to resend selected invitations"""
-        from django.utils import timezone
-        from guests.views import send_invitation_email
+        """Admin action to queue the selected invitations for resending"""
+        from guests.emails import queue_invitation_emails
         
-        sent_count = 0
-        for invitation in queryset:
-            try:
-                send_invitation_email(invitation, request)
-                invitation.email_sent = True
-                invitation.email_sent_at = timezone.now()
-                invitation.status = 'sent'
-                invitation.save(update_fields=['email_sent', 'email_sent_at', 'status'])
-                sent_count += 1
-            except Exception as e:
-                self.message_user(request, f'Error sending to {invitation.guest.full_name}: {str(e)}', level='ERROR')
+        queued_count = 0
+        # One send job per event, so progress shows on each event's dashboard
+        for event in Event.objects.filter(pk__in=queryset.values('event')):
+            job = queue_invitation_emails(event, queryset.filter(event=event), request.user, request)
+            if job:
+                queued_count += job.total
         
-        self.message_user(request, f'Successfully resent {sent_count} invitation(s)!')
+        if queued_count:
+            self.message_user(request, f'{queued_count} invitation(s) queued for resending!')
+        else:
+            self.message_user(request, 'No invitations to send: every selected guest\'s email has bounced.',
+                              messages.WARNING)
     
     resend_invitations_action.short_description = "Resend selected invitations"
     
+    def get_search_results(self, request, queryset, search_term):
+        unsearched = queryset
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        # Barcodes of newer invitations are not stored; resolve them to the primary key
+        # within the filtered list the search was made on
+        pk = decode_barcode(search_term.strip())
+        if pk is not None:
+            queryset |= unsearched.filter(pk=pk, barcode_number__isnull=True)
+        return queryset, may_have_duplicates
+    
     def rsvp_status(self, obj):
         if hasattr(obj, 'rsvp'):
             status = obj.rsvp.get_response_display()
@@ -136,14 +149,14 @@ class InvitationAdmin(admin.ModelAdmin):
     rsvp_link.short_description = 'RSVP Link'
     
     def barcode_display(self, obj):
-        if obj.barcode_image:
-            return format_html('<img src="{}" style="max-width: 300px;" />', obj.barcode_image.url)
+        if obj.pk:
+            return format_html('<img src="{}" style="max-width: 300px;" />', obj.get_barcode_url())
         return '-'
     barcode_display.short_description = 'Barcode'
     
     def qr_display(self, obj):
-        if obj.qr_code:
-            return format_html('<img src="{}" style="max-width: 150px;" />', obj.qr_code.url)
+        if obj.pk:
+            return format_html('<img src="{}" style="max-width: 150px;" />', obj.get_qr_code_url())
         return '-'
     qr_display.short_description = 'QR Code'
 
@@ -195,6 +208,32 @@ class EventAnalyticsAdmin(admin.ModelAdmin):
         return f"{obj.response_rate:.1f}%"
     response_rate.short_description = 'Response Rate'
 
+@admin.register(SendJob)
+class SendJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event', 'status', 'total', 'sent_count', 'failed_count', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'email_type', 'event']
+    # The email type is fixed when a job is queued (only types with a template can be)
+    readonly_fields = ['email_type', 'created_at', 'started_at', 'finished_at', 'last_invitation_id', 'processed_at_start']
+    actions = ['pause_jobs', 'resume_jobs', 'cancel_jobs']
+    
+    def pause_jobs(self, request, queryset):
+        from guests.emails import pause_send_job
+        paused = sum(pause_send_job(job.pk) for job in queryset)
+        self.message_user(request, f'{paused} send job(s) paused.')
+    pause_jobs.short_description = 'Pause selected send jobs'
+    
+    def resume_jobs(self, request, queryset):
+        from guests.emails import resume_send_job
+        resumed = sum(resume_send_job(job.pk) for job in queryset)
+        self.message_user(request, f'{resumed} send job(s) resumed.')
+    resume_jobs.short_description = 'Resume selected send jobs'
+    
+    def cancel_jobs(self, request, queryset):
+        from guests.emails import cancel_send_job
+        cancelled = sum(cancel_send_job(job.pk) for job in queryset)
+        self.message_user(request, f'{cancelled} send job(s) cancelled.')
+    cancel_jobs.short_description = 'Cancel selected send jobs'
+
 @admin.register(EmailTemplate)
 class EmailTemplateAdmin(admin.ModelAdmin):
     list_display = ['name', 'template_type', 'is_default', 'created_by', 'created_at']
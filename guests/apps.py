@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class GuestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'guests'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .email_rendering import invalidate_event_renders
+
+        post_save.connect(invalidate_event_renders, sender='guests.Event',
+                          dispatch_uid='guests.invalidate_event_renders.save')
+        post_delete.connect(invalidate_event_renders, sender='guests.Event',
+                            dispatch_uid='guests.invalidate_event_renders.delete')
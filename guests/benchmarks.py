@@ -0,0 +1,287 @@
+"""
+Micro-benchmarks for the invitation pipeline.
+
+Each benchmark returns plain dicts so results can be printed by the
+management commands or written out as JSON for comparison between commits.
+"""
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from .codes import (
+    CODE_FORMATS, CODE_KINDS, code_payload, encode_barcode, generate_event_codes, render_code,
+)
+from .email_rendering import clear_render_cache, render_invitation_email, render_invitation_templates
+from .mail_scheduler import MailScheduler
+from .models import Event, Guest, Invitation
+
+PIPELINE_SIZES = (1000, 10000, 100000)
+
+
+def benchmark_code_rendering(count=200):
+    """Compare render time and output size of PNG and SVG codes"""
+    codes = [uuid.uuid4() for _ in range(count)]
+    payloads = {
+        kind: [code_payload(kind, code, encode_barcode(pk)) for pk, code in enumerate(codes, 1)]
+        for kind in CODE_KINDS
+    }
+    results = []
+    for kind in CODE_KINDS:
+        for fmt in CODE_FORMATS:
+            total_bytes = 0
+            started = time.perf_counter()
+            for payload in payloads[kind]:
+                total_bytes += len(render_code(kind, payload, fmt))
+            elapsed = time.perf_counter() - started
+            results.append({
+                'kind': kind,
+                'format': fmt,
+                'count': count,
+                'seconds': round(elapsed, 4),
+                'ms_per_code': round(elapsed * 1000 / count, 3),
+                'codes_per_second': round(count / elapsed, 1),
+                'bytes_per_code': total_bytes // count,
+            })
+    return results
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Run benchmarks in a new test database (as the test runner creates it),
+    destroyed afterwards, so the configured database is never written to.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def _rolled_back():
+    """Run a benchmark in a transaction that is always rolled back"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def _measure(name, rows, func, trace_memory):
+    """
+    Time ``func`` and count its queries; with ``trace_memory`` record the
+    peak Python memory instead of the time.
+
+    tracemalloc slows allocation-heavy code down several times over, so
+    time and memory are measured in separate runs.
+    """
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            func()
+            return {'peak_memory_kb': tracemalloc.get_traced_memory()[1] // 1024}
+        finally:
+            tracemalloc.stop()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+    return {
+        'benchmark': name,
+        'rows': rows,
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+        'queries': len(queries),
+        'queries_per_row': round(len(queries) / rows, 3),
+    }
+
+
+def _create_event():
+    user = User.objects.create_user(username=f'benchmark-{uuid.uuid4().hex[:12]}')
+    return Event.objects.create(
+        name='Benchmark Event', date=timezone.now(), location='Benchmark', created_by=user,
+    )
+
+
+def _create_guests(count):
+    # bulk_create does not return primary keys on every backend; tag the rows instead
+    last_name = f'Benchmark-{uuid.uuid4().hex[:12]}'
+    guests = [
+        Guest(first_name=f'Guest{i}', last_name=last_name, email=f'guest{i}@example.com')
+        for i in range(count)
+    ]
+    Guest.objects.bulk_create(guests, batch_size=1000)
+    return list(Guest.objects.filter(last_name=last_name).values_list('pk', flat=True))
+
+
+def benchmark_invitation_save(rows, trace_memory=False):
+    """Invitations created one at a time through Invitation.save()"""
+    with _rolled_back():
+        event = _create_event()
+        guest_ids = _create_guests(rows)
+
+        def create():
+            for guest_id in guest_ids:
+                Invitation.objects.create(event=event, guest_id=guest_id)
+
+        return _measure('invitation_save', rows, create, trace_memory)
+
+
+def benchmark_bulk_invite(rows, trace_memory=False):
+    """Invitations created through Invitation.objects.bulk_invite()"""
+    with _rolled_back():
+        event = _create_event()
+        guest_ids = _create_guests(rows)
+        return _measure(
+            'bulk_invite', rows, lambda: Invitation.objects.bulk_invite(event, guest_ids), trace_memory
+        )
+
+
+def benchmark_import_guests(rows, trace_memory=False):
+    """A CSV of new guests imported with invitations via import_guests"""
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['first_name', 'last_name', 'email', 'phone', 'address'])
+        for i in range(rows):
+            writer.writerow([f'Guest{i}', 'Import', f'import{i}@example.com', '', ''])
+    try:
+        with _rolled_back(), open(os.devnull, 'w') as devnull:
+            event = _create_event()
+            return _measure('import_guests', rows, lambda: call_command(
+                'import_guests', csv_file.name, event_id=event.pk, create_invitations=True,
+                stdout=devnull,
+            ), trace_memory)
+    finally:
+        os.unlink(csv_file.name)
+
+
+def benchmark_code_generation(rows, trace_memory=False):
+    """
+    QR codes and barcodes rendered for every invitation. The images go to a
+    dummy cache, so neither memory nor the configured cache fills up with
+    them and only rendering and queries are measured.
+
+    Runs with a single worker, in this process; throughput scales with the
+    number of workers.
+    """
+    caches = {
+        **settings.CACHES,
+        settings.QR_CODE_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    }
+    with _rolled_back(), override_settings(CACHES=caches):
+        event = _create_event()
+        Invitation.objects.bulk_invite(event, _create_guests(rows))
+        return _measure(
+            'code_generation', rows, lambda: generate_event_codes(event, workers=1), trace_memory
+        )
+
+
+def _email_invitations(rows):
+    """Unsaved invitations for rendering benchmarks (no database access)"""
+    user = User(username='benchmark')
+    event = Event(
+        name='Benchmark Event', description='An evening of benchmarks. ' * 10, date=timezone.now(),
+        location='Benchmark Hall', created_by=user, updated_at=timezone.now(),
+    )
+    return [
+        Invitation(event=event, guest=Guest(first_name=f'Guest{i}', last_name='Benchmark'))
+        for i in range(rows)
+    ]
+
+
+def _render_emails(invitations, render):
+    for invitation in invitations:
+        render(invitation, f'https://example.com/rsvp/{invitation.unique_code}/',
+               f'https://example.com/codes/{invitation.unique_code}/qr.png')
+
+
+def benchmark_email_render_uncached(rows, trace_memory=False):
+    """Invitation emails rendered from the templates for every guest"""
+    invitations = _email_invitations(rows)
+    return _measure('email_render_uncached', rows,
+                    lambda: _render_emails(invitations, render_invitation_templates), trace_memory)
+
+
+def benchmark_email_render_cached(rows, trace_memory=False):
+    """Invitation emails filled in from a per-event render"""
+    invitations = _email_invitations(rows)
+    clear_render_cache()
+    try:
+        return _measure('email_render_cached', rows,
+                        lambda: _render_emails(invitations, render_invitation_email), trace_memory)
+    finally:
+        clear_render_cache()
+
+
+PIPELINE_BENCHMARKS = {
+    'invitation_save': benchmark_invitation_save,
+    'bulk_invite': benchmark_bulk_invite,
+    'import_guests': benchmark_import_guests,
+    'code_generation': benchmark_code_generation,
+    'email_render_uncached': benchmark_email_render_uncached,
+    'email_render_cached': benchmark_email_render_cached,
+}
+
+
+def benchmark_pipeline(sizes=PIPELINE_SIZES, benchmarks=None, memory=True, progress=None):
+    """
+    Run the invitation pipeline benchmarks at each size.
+
+    Nothing is left in the database. With ``memory`` each benchmark is run
+    a second time to record its peak memory. Returns a dict with the
+    environment and one result row per benchmark and size; ``progress`` is
+    called with each row as it completes.
+    """
+    results = []
+    for name in benchmarks or PIPELINE_BENCHMARKS:
+        for rows in sizes:
+            row = PIPELINE_BENCHMARKS[name](rows)
+            row['peak_memory_kb'] = (
+                PIPELINE_BENCHMARKS[name](rows, trace_memory=True)['peak_memory_kb'] if memory else None
+            )
+            results.append(row)
+            if progress:
+                progress(row)
+    return {
+        'database': connection.vendor,
+        'created_at': timezone.now().isoformat(),
+        'results': results,
+    }
+
+
+def benchmark_email_delivery(count=200, **scheduler_options):
+    """
+    Send ``count`` test messages through a MailScheduler and report the
+    achieved rate.
+
+    Messages go to the configured EMAIL_BACKEND, so point it at a local
+    SMTP stand-in (e.g. ``python -m aiosmtpd -n -l localhost:1025``) rather
+    than a real provider. ``scheduler_options`` override the
+    MailScheduler settings (workers, per_second, per_hour, batch_size).
+    """
+    scheduler = MailScheduler(**scheduler_options)
+    messages = (
+        (i, EmailMessage(f'Benchmark message {i}', 'Benchmark', settings.DEFAULT_FROM_EMAIL,
+                         [f'guest{i}@example.com']))
+        for i in range(count)
+    )
+    for _ in scheduler.send(messages):
+        pass
+    return {
+        'count': count,
+        'workers': scheduler.workers,
+        'batch_size': scheduler.batch_size,
+        **scheduler.stats.as_dict(),
+    }
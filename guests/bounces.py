@@ -0,0 +1,175 @@
+"""
+Bounce processing from a local mailbox.
+
+Delivery status notifications (RFC 3464) are read from an mbox file or a
+Maildir one message at a time: an mbox is split on its "From " lines while
+it is read, so neither format is ever loaded whole. Permanently failed
+recipients are matched against an in-memory index of guest addresses, and
+matched guests are suppressed in batches: one UPDATE for the guests, one for
+their sent invitations and one EventAnalytics increment per event.
+"""
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from email import message_from_binary_file, policy
+from email.feedparser import BytesFeedParser
+from email.utils import parseaddr
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Guest, Invitation
+from .tracking import increment_analytics
+
+logger = logging.getLogger(__name__)
+
+
+def iter_mbox(path):
+    """Yield the messages of an mbox file, parsing each as it is read"""
+    parser = None
+    after_blank = True
+    with open(path, 'rb') as mbox:
+        for line in mbox:
+            # A separator follows a blank line; unquoted "From " in a body does not
+            if after_blank and line.startswith(b'From '):
+                if parser is not None:
+                    yield parser.close()
+                parser = BytesFeedParser(policy=policy.compat32)
+                continue
+            after_blank = not line.strip()
+            if parser is not None:
+                # Undo mboxrd/mboxo quoting of body lines starting with "From "
+                if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                    line = line[1:]
+                parser.feed(line)
+    if parser is not None:
+        yield parser.close()
+
+
+def iter_maildir(path):
+    """Yield the messages of a Maildir, one file at a time"""
+    for subdir in ('new', 'cur'):
+        try:
+            entries = os.scandir(os.path.join(path, subdir))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    with open(entry.path, 'rb') as message_file:
+                        yield message_from_binary_file(message_file, policy=policy.compat32)
+
+
+def iter_mailbox(path):
+    """Messages of a Maildir (a directory) or an mbox file"""
+    if os.path.isdir(path):
+        return iter_maildir(path)
+    return iter_mbox(path)
+
+
+def _address(value):
+    # Final-Recipient: rfc822; guest@example.com
+    _, _, address = (value or '').rpartition(';')
+    return parseaddr(address.strip())[1].lower()
+
+
+def bounced_recipients(message):
+    """
+    Addresses that permanently failed according to a DSN, or according to
+    an X-Failed-Recipients header (Exim) when there is no DSN part.
+    """
+    addresses = set()
+    for part in message.walk():
+        if part.get_content_type() != 'message/delivery-status':
+            continue
+        # The per-message fields come first, then one block per recipient
+        for block in part.get_payload()[1:]:
+            action = (block.get('Action') or '').strip().lower()
+            status = (block.get('Status') or '').strip()
+            if action == 'failed' or status.startswith('5'):
+                address = _address(block.get('Final-Recipient') or block.get('Original-Recipient'))
+                if address:
+                    addresses.add(address)
+    if not addresses:
+        for header in message.get_all('X-Failed-Recipients') or []:
+            addresses.update(parseaddr(item.strip())[1].lower() for item in header.split(','))
+        addresses.discard('')
+    return addresses
+
+
+def guest_index():
+    """Lower-cased email address -> ids of the guests using it"""
+    index = {}
+    for pk, email in Guest.objects.values_list('pk', 'email').iterator(chunk_size=5000):
+        index.setdefault(email.lower(), []).append(pk)
+    return index
+
+
+@dataclass
+class BounceResult:
+    messages: int = 0
+    bounces: int = 0
+    unmatched: int = 0
+    guests: int = 0
+    invitations: int = 0
+    per_event: Counter = field(default_factory=Counter)
+
+
+def suppress_guests(guest_ids, now=None):
+    """
+    Mark guests as bounced and their sent invitations as 'bounced'; returns
+    the numbers of guests and invitations newly marked, and the invitations
+    per event. Only 'sent' invitations change, so processing a mailbox twice
+    counts nothing twice.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        guests = Guest.objects.filter(pk__in=guest_ids, email_bounced_at__isnull=True).update(
+            email_bounced_at=now
+        )
+        invitations = Invitation.objects.filter(guest_id__in=guest_ids, status='sent')
+        per_event = Counter(dict(invitations.values_list('event_id').annotate(count=Count('pk')).order_by()))
+        updated = invitations.update(status='bounced')
+        for event_id, count in per_event.items():
+            increment_analytics(event_id, emails_bounced=count)
+    return guests, updated, per_event
+
+
+def process_bounces(path, batch_size=1000, dry_run=False):
+    """Read a mailbox of bounces and suppress the guests whose mail bounced"""
+    result = BounceResult()
+    index = guest_index()
+    pending = set()
+    # Dry run: guests already counted, as an address can bounce in several batches
+    counted = set()
+
+    def flush():
+        if dry_run:
+            new = pending - counted
+            counted.update(new)
+            if new:
+                result.guests += Guest.objects.filter(pk__in=new, email_bounced_at__isnull=True).count()
+        elif pending:
+            guests, invitations, per_event = suppress_guests(pending)
+            result.guests += guests
+            result.invitations += invitations
+            result.per_event.update(per_event)
+        pending.clear()
+
+    for message in iter_mailbox(path):
+        result.messages += 1
+        for address in bounced_recipients(message):
+            result.bounces += 1
+            guest_ids = index.get(address)
+            if guest_ids is None:
+                result.unmatched += 1
+                continue
+            if dry_run:
+                logger.info(f"Bounced address: {address}")
+            pending.update(guest_ids)
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    return result
@@ -0,0 +1,79 @@
+"""
+Disk cache backend for many small entries, such as rendered invitation codes.
+
+Django's FileBasedCache keeps every entry in one directory and lists all of
+it on each ``set()`` to decide whether to cull, so filling it gets
+quadratically slower, and culling removes random entries. This backend
+spreads entries over 256 shard directories (``<dir>/<ab>/<md5>.djcache``),
+and each ``set()`` only looks at the shard it writes to. A full shard drops
+its least recently used entries: reads refresh an entry's modification time.
+"""
+import glob
+import os
+import tempfile
+from hashlib import md5
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.move import file_move_safe
+
+SHARDS = 256
+
+
+class ShardedFileCache(FileBasedCache):
+    """FileBasedCache with sharded directories and per-shard LRU culling"""
+
+    def _key_to_file(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        digest = md5(key.encode(), usedforsecurity=False).hexdigest()
+        return os.path.join(self._dir, digest[:2], f'{digest}{self.cache_suffix}')
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, default, version)
+        if value is not default:
+            try:
+                os.utime(self._key_to_file(key, version))
+            except FileNotFoundError:
+                pass
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        fname = self._key_to_file(key, version)
+        shard = os.path.dirname(fname)
+        os.makedirs(shard, 0o700, exist_ok=True)
+        self._cull_shard(shard)
+        fd, tmp_path = tempfile.mkstemp(dir=shard)
+        renamed = False
+        try:
+            with open(fd, 'wb') as f:
+                self._write_content(f, timeout, value)
+            file_move_safe(tmp_path, fname, allow_overwrite=True)
+            renamed = True
+        finally:
+            if not renamed:
+                os.remove(tmp_path)
+
+    def _cull_shard(self, shard):
+        """Make room in a shard holding its share of MAX_ENTRIES"""
+        limit = max(1, self._max_entries // SHARDS)
+        with os.scandir(shard) as entries:
+            files = [entry for entry in entries if entry.name.endswith(self.cache_suffix)]
+        if len(files) < limit:
+            return
+        if self._cull_frequency == 0:
+            doomed = files
+        else:
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            doomed = files[:max(1, len(files) // self._cull_frequency)]
+        for entry in doomed:
+            self._delete(entry.path)
+
+    def _cull(self):
+        # Culling happens per shard in set()
+        pass
+
+    def _list_cache_files(self):
+        return [
+            os.path.join(self._dir, fname)
+            for fname in glob.glob(f'*/*{self.cache_suffix}', root_dir=self._dir)
+        ]
@@ -0,0 +1,446 @@
+"""
+QR code and barcode rendering for invitations.
+
+The render functions are pure (they take plain values and return image
+bytes) so they can run in worker processes without touching the database.
+Codes can be rendered as PNG or as SVG, which is smaller and scales to any
+print size without re-rendering.
+"""
+import base64
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from io import BytesIO
+from itertools import groupby
+
+import barcode
+import qrcode
+from barcode.writer import ImageWriter
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.html import escape
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+CODE_KINDS = ('qr', 'barcode')
+
+CODE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Bump when rendering options change so cached images are not reused.
+RENDER_VERSION = 1
+
+BARCODE_PK_DIGITS = 6
+BARCODE_CHECK_DIGITS = 4
+LEGACY_BARCODE_LENGTH = 12
+
+BARCODE_WRITER_OPTIONS = {
+    'module_width': 0.3,
+    'module_height': 10,
+    'quiet_zone': 2,
+    'font_size': 10,
+    'text_distance': 3,
+}
+
+
+def qr_payload(unique_code):
+    """Data encoded in an invitation's QR code"""
+    return f"http://localhost:8000/rsvp/{unique_code}/"
+
+
+def _barcode_check(pk, secret=None):
+    digest = salted_hmac('guests.barcode', str(pk), secret=secret or settings.BARCODE_SECRET).hexdigest()
+    return int(digest, 16) % 10 ** BARCODE_CHECK_DIGITS
+
+
+def encode_barcode(pk):
+    """
+    Barcode value for an invitation: the zero-padded primary key followed by
+    HMAC check digits keyed on BARCODE_SECRET.
+    """
+    return f'{pk:0{BARCODE_PK_DIGITS}d}{_barcode_check(pk):0{BARCODE_CHECK_DIGITS}d}'
+
+
+def decode_barcode(value):
+    """
+    Return the invitation primary key encoded in a barcode, or None if the
+    value is malformed or its check digits match neither BARCODE_SECRET nor
+    any of BARCODE_SECRET_FALLBACKS. Needs no database.
+    """
+    if not value.isdigit() or len(value) < BARCODE_PK_DIGITS + BARCODE_CHECK_DIGITS:
+        return None
+    pk, check = int(value[:-BARCODE_CHECK_DIGITS]), int(value[-BARCODE_CHECK_DIGITS:])
+    for secret in [settings.BARCODE_SECRET, *settings.BARCODE_SECRET_FALLBACKS]:
+        if constant_time_compare(str(check), str(_barcode_check(pk, secret))):
+            return pk
+    return None
+
+
+def is_legacy_barcode(value):
+    """Whether a value has the shape of the old MD5-derived barcode numbers"""
+    return value.isdigit() and len(value) == LEGACY_BARCODE_LENGTH
+
+
+def default_code_format():
+    return settings.INVITATION_CODE_FORMAT
+
+
+def _make_qr(payload, **kwargs):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+        **kwargs
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr_png_for_payload(payload):
+    """Render a QR code as PNG bytes"""
+    qr_image = _make_qr(payload).make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    qr_image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def qr_matrix(payload):
+    """QR modules as rows of booleans (True is dark), including the border"""
+    return _make_qr(payload).get_matrix()
+
+
+def barcode_modules(barcode_value):
+    """Code128 modules as a string of '1' (bar) and '0' (space)"""
+    return barcode.get_barcode_class('code128')(barcode_value).build()[0]
+
+
+def render_qr_svg_for_payload(payload):
+    """Render a QR code as SVG, one path with a unit square per module"""
+    matrix = qr_matrix(payload)
+    size = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        for dark, run in groupby(row):
+            length = len(list(run))
+            if dark:
+                path.append(f'M{x},{y}h{length}v1h-{length}z')
+            x += length
+    # box_size is in pixels; at 96 dpi that is 10px per module
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" viewBox="0 0 {size} {size}" '
+        f'width="{size * 10}" height="{size * 10}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="white"/>'
+        f'<path fill="black" d="{"".join(path)}"/>'
+        f'</svg>'
+    ).encode()
+
+
+def render_barcode_png(barcode_number):
+    """Render a Code128 barcode as PNG bytes"""
+    code128 = barcode.get_barcode_class('code128')
+    barcode_instance = code128(barcode_number, writer=ImageWriter())
+    buffer = BytesIO()
+    barcode_instance.write(buffer, options=BARCODE_WRITER_OPTIONS)
+    return buffer.getvalue()
+
+
+def render_barcode_svg(barcode_number):
+    """
+    Render a Code128 barcode as SVG.
+
+    The bars are drawn as one path in module units with a viewBox, so the
+    image can be resized freely. Proportions match the PNG rendering.
+    """
+    options = BARCODE_WRITER_OPTIONS
+    modules = barcode_modules(barcode_number)
+    module_width = options['module_width']
+    quiet = options['quiet_zone'] / module_width
+    bar_height = options['module_height'] / module_width
+    font_size = options['font_size'] * 0.3528 / module_width  # points to modules
+    text_y = bar_height + options['text_distance'] / module_width
+    width = len(modules) + 2 * quiet
+    height = text_y + font_size / 2
+
+    bars = []
+    x = 0
+    for module, run in groupby(modules):
+        length = len(list(run))
+        if module == '1':
+            bars.append(f'M{quiet + x:g},0h{length}v{bar_height:g}h-{length}z')
+        x += length
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" viewBox="0 0 {width:g} {height:g}" '
+        f'width="{width * module_width:g}mm" height="{height * module_width:g}mm">'
+        f'<rect width="100%" height="100%" fill="white"/>'
+        f'<path fill="black" d="{"".join(bars)}"/>'
+        f'<text x="{width / 2:g}" y="{text_y:g}" font-family="monospace" font-size="{font_size:g}" '
+        f'text-anchor="middle">{escape(barcode_number)}</text>'
+        f'</svg>'
+    ).encode()
+
+
+def qr_filename(unique_code, fmt='png'):
+    return f'qr_{unique_code}.{fmt}'
+
+
+def barcode_filename(unique_code, fmt='png'):
+    return f'barcode_{unique_code}.{fmt}'
+
+
+def _render_job(job):
+    """Worker entry point: render the requested images for one invitation"""
+    pk, unique_code, barcode_value, want_qr, want_barcode, fmt = job
+    try:
+        qr_image = render_code('qr', qr_payload(unique_code), fmt) if want_qr else None
+        barcode_image = render_code('barcode', barcode_value, fmt) if want_barcode else None
+    except Exception as e:
+        return pk, None, None, f'{type(e).__name__}: {e}'
+    return pk, qr_image, barcode_image, None
+
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+
+def worker_pool(workers):
+    """
+    Process pool for the pure render functions. Workers are spawned, not
+    forked: a forked worker would inherit the parent's open database
+    connections (and a server-side cursor still being read), and closing or
+    reusing them from the child breaks them for the parent.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def missing_codes_filter():
+    """Q object matching invitations without a QR code or barcode image"""
+    return (
+        Q(qr_code='') | Q(qr_code__isnull=True) |
+        Q(barcode_image='') | Q(barcode_image__isnull=True)
+    )
+
+
+def code_cache():
+    return caches[settings.QR_CODE_CACHE_ALIAS]
+
+
+def code_payload(kind, unique_code, barcode_value):
+    """Value encoded in an invitation's code of the given kind"""
+    if kind == 'qr':
+        return qr_payload(unique_code)
+    return barcode_value
+
+
+def code_etag(kind, payload, fmt='png'):
+    """Content address of a rendered code image"""
+    digest = hashlib.sha256(f'{RENDER_VERSION}:{kind}:{fmt}:{payload}'.encode()).hexdigest()
+    return digest[:32]
+
+
+def code_cache_key(kind, payload, fmt='png'):
+    return f'code:{code_etag(kind, payload, fmt)}'
+
+
+_RENDERERS = {
+    ('qr', 'png'): render_qr_png_for_payload,
+    ('qr', 'svg'): render_qr_svg_for_payload,
+    ('barcode', 'png'): render_barcode_png,
+    ('barcode', 'svg'): render_barcode_svg,
+}
+
+
+def render_code(kind, payload, fmt='png'):
+    return _RENDERERS[kind, fmt](payload)
+
+
+def get_code_image(kind, payload, fmt='png'):
+    """Return the image bytes for a code, rendering and caching them on a miss"""
+    cache = code_cache()
+    key = code_cache_key(kind, payload, fmt)
+    image = cache.get(key)
+    if image is None:
+        image = render_code(kind, payload, fmt)
+        cache.set(key, image, None)
+    return image
+
+
+@functools.lru_cache(maxsize=1024)
+def encoded_code_image(kind, payload):
+    """
+    A PNG code image base64-encoded for a MIME part, cached so repeated
+    sends do not render or encode it again.
+    """
+    cache = code_cache()
+    key = f'mime:{code_cache_key(kind, payload)}'
+    encoded = cache.get(key)
+    if encoded is None:
+        encoded = base64.encodebytes(get_code_image(kind, payload)).decode('ascii')
+        cache.set(key, encoded, None)
+    return encoded
+
+
+@dataclass
+class CodeGenerationResult:
+    total: int = 0
+    rendered: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)  # (invitation pk, message)
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    @property
+    def processed(self):
+        return self.rendered + self.skipped + self.failed
+
+
+def generate_missing_codes(invitations, workers=None, force=False, store=False, fmt=None,
+                           progress=None, chunk_size=500):
+    """
+    Render QR codes and barcodes for a queryset of invitations.
+
+    By default the images are written to the code image cache, in batches
+    of ``chunk_size`` with ``set_many()``, so the image endpoint can serve
+    them without rendering. With ``store`` they
+    are saved to the invitations' image fields instead. ``fmt`` is 'png'
+    or 'svg' and defaults to ``settings.INVITATION_CODE_FORMAT``.
+
+    Rendering is spread across a process pool (one worker per core by
+    default) while this process stores the results. Only codes that are
+    not cached (or stored) yet are rendered unless ``force`` is set.
+    ``progress`` is called as ``progress(done, total)`` after each item.
+    A failure on one invitation is recorded in the result and does not stop
+    the batch.
+    """
+    if store and not force:
+        invitations = invitations.filter(missing_codes_filter())
+    invitations = invitations.order_by('pk')
+
+    result = CodeGenerationResult(total=invitations.count())
+    if not result.total:
+        return result
+
+    fmt = fmt or default_code_format()
+    cache = code_cache()
+    workers = max(1, min(workers or default_worker_count(), result.total))
+    pending = {}
+    # Rendered images waiting to be written to the cache with one set_many()
+    to_cache = {}
+
+    def flush_cache():
+        if to_cache:
+            cache.set_many(to_cache, None)
+            to_cache.clear()
+
+    def report():
+        if progress:
+            progress(result.processed, result.total)
+
+    def wanted(invitation, kind):
+        if force:
+            return True
+        if store:
+            return not (invitation.qr_code if kind == 'qr' else invitation.barcode_image)
+        payload = code_payload(kind, invitation.unique_code, invitation.barcode)
+        return not cache.has_key(code_cache_key(kind, payload, fmt))
+
+    def jobs():
+        for invitation in invitations.iterator(chunk_size=chunk_size):
+            want_qr, want_barcode = wanted(invitation, 'qr'), wanted(invitation, 'barcode')
+            if not (want_qr or want_barcode):
+                result.skipped += 1
+                report()
+                continue
+            pending[invitation.pk] = invitation
+            yield (
+                invitation.pk,
+                str(invitation.unique_code),
+                invitation.barcode,
+                want_qr,
+                want_barcode,
+                fmt,
+            )
+
+    def save(outcome):
+        pk, qr_image, barcode_image, error = outcome
+        invitation = pending.pop(pk)
+        if error is None:
+            try:
+                if store:
+                    _store_codes(invitation, qr_image, barcode_image, fmt)
+                else:
+                    to_cache.update(_code_images(invitation, qr_image, barcode_image, fmt))
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        if error is None:
+            result.rendered += 1
+        else:
+            logger.error(f"Code generation failed for invitation {pk}: {error}")
+            result.errors.append((pk, error))
+        if len(to_cache) >= chunk_size:
+            flush_cache()
+        report()
+
+    if workers == 1:
+        for job in jobs():
+            save(_render_job(job))
+        flush_cache()
+        return result
+
+    with worker_pool(workers) as executor:
+        in_flight = set()
+        for job in jobs():
+            in_flight.add(executor.submit(_render_job, job))
+            # Bound the number of rendered images held in memory at once.
+            if len(in_flight) >= workers * 4:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    save(future.result())
+        for future in in_flight:
+            save(future.result())
+    flush_cache()
+    return result
+
+
+def generate_event_codes(event, **kwargs):
+    """Render every missing QR code and barcode for an event"""
+    return generate_missing_codes(event.invitations.all(), **kwargs)
+
+
+def _code_images(invitation, qr_image, barcode_image, fmt):
+    """Cache keys and images of an invitation's rendered codes"""
+    images = {}
+    if qr_image is not None:
+        images[code_cache_key('qr', qr_payload(invitation.unique_code), fmt)] = qr_image
+    if barcode_image is not None:
+        images[code_cache_key('barcode', invitation.barcode, fmt)] = barcode_image
+    return images
+
+
+def _store_codes(invitation, qr_image, barcode_image, fmt):
+    update_fields = []
+    if qr_image is not None:
+        invitation.qr_code.save(qr_filename(invitation.unique_code, fmt), ContentFile(qr_image), save=False)
+        update_fields.append('qr_code')
+    if barcode_image is not None:
+        invitation.barcode_image.save(
+            barcode_filename(invitation.unique_code, fmt), ContentFile(barcode_image), save=False
+        )
+        update_fields.append('barcode_image')
+    type(invitation)._default_manager.filter(pk=invitation.pk).update(
+        **{name: getattr(invitation, name) for name in update_fields}
+    )
@@ -0,0 +1,271 @@
+"""
+Cached rendering of invitation emails.
+
+Emails render from the organizer's EmailTemplate for the kind of email
+being sent, or from the built-in template files when there is none.
+EmailTemplate sources are compiled once per edit: compiled templates are
+cached in process under the template's primary key and ``updated_at``, so an
+edited template takes effect on the next send without restarting workers.
+
+Everything in an email except a few guest fields is the same for every
+guest of an event, so the templates are rendered once per event with marker
+strings in place of those fields. Each guest's email is then built by
+joining the pre-rendered pieces with the guest's (escaped) values. Templates
+that use any other per-guest value are rendered per guest instead.
+
+Renders are keyed on the event's ``updated_at``, so an edited event is never
+served from a stale render, and an event's entries are also dropped when it
+is saved or deleted in this process.
+"""
+import functools
+import re
+import secrets
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from django.template import engines
+from django.template.loader import get_template
+from django.utils.html import conditional_escape
+
+from .models import EmailTemplate
+
+# Built-in (subject, HTML template, text template) per kind of email
+DEFAULT_TEMPLATES = {
+    'invitation': (
+        "You're invited to {{ invitation.event.name }}!",
+        'guests/invitation_email.html',
+        'guests/invitation_email.txt',
+    ),
+    'reminder': (
+        'Reminder: please RSVP for {{ invitation.event.name }}',
+        'guests/reminder_email.html',
+        'guests/reminder_email.txt',
+    ),
+}
+
+# Per-guest values; templates must output them without filters.
+GUEST_FIELDS = ('first_name', 'last_name', 'full_name', 'rsvp_url', 'qr_image_url', 'open_pixel_url')
+
+# Whether guest values are HTML-escaped in the subject, HTML and text parts
+ESCAPE_PARTS = (False, True, False)
+
+MAX_CACHED_RENDERS = 64
+MAX_COMPILED_TEMPLATES = 64
+
+# Random per process so event text can never contain a marker by accident
+_MARKER_PREFIX = f'guestfield{secrets.token_hex(6)}'
+_MARKERS = {field: f'{_MARKER_PREFIX}{field}end' for field in GUEST_FIELDS}
+_FIELD_BY_MARKER = {marker: field for field, marker in _MARKERS.items()}
+_MARKER_PATTERN = re.compile(f"({'|'.join(map(re.escape, _MARKERS.values()))})")
+
+_renders = OrderedDict()
+_compiled = OrderedDict()
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class EmailTemplates:
+    """Compiled subject, HTML and text templates of one kind of email"""
+    key: tuple
+    subject: object
+    html: object
+    text: object
+
+    def render(self, context):
+        return [self.subject.render(context).strip(), self.html.render(context), self.text.render(context)]
+
+
+def _compile(source, autoescape=True):
+    if not autoescape:
+        source = f'{{% autoescape off %}}{source}{{% endautoescape %}}'
+    return engines['django'].from_string(source)
+
+
+def _compile_subject(source):
+    # Header values cannot span lines
+    return _compile(' '.join(source.split()), autoescape=False)
+
+
+def compile_email_template(email_template):
+    """Compile an EmailTemplate's sources; raises TemplateSyntaxError if they are invalid"""
+    return EmailTemplates(
+        key=('db', email_template.pk, email_template.updated_at),
+        subject=_compile_subject(email_template.subject),
+        html=_compile(email_template.html_content),
+        text=_compile(email_template.text_content, autoescape=False),
+    )
+
+
+def compiled_email_template(email_template):
+    """The compiled templates of an EmailTemplate, cached until it is edited"""
+    key = (email_template.pk, email_template.updated_at)
+    with _lock:
+        if key in _compiled:
+            _compiled.move_to_end(key)
+            return _compiled[key]
+    templates = compile_email_template(email_template)
+    with _lock:
+        _compiled[key] = templates
+        while len(_compiled) > MAX_COMPILED_TEMPLATES:
+            _compiled.popitem(last=False)
+    return templates
+
+
+@functools.lru_cache(maxsize=None)
+def default_email_templates(template_type='invitation'):
+    """The built-in templates for a kind of email"""
+    try:
+        subject, html, text = DEFAULT_TEMPLATES[template_type]
+    except KeyError:
+        raise ValueError(f'There is no {template_type} email template') from None
+    return EmailTemplates(
+        key=('file', template_type),
+        subject=_compile_subject(subject),
+        html=get_template(html),
+        text=get_template(text),
+    )
+
+
+def find_email_template(event, template_type='invitation'):
+    """The organizer's default EmailTemplate of a type, if they have one"""
+    return (
+        EmailTemplate.objects.filter(
+            created_by_id=event.created_by_id, template_type=template_type, is_default=True
+        ).order_by('-updated_at').first()
+    )
+
+
+def can_send(event, template_type):
+    """Whether emails of a type can be rendered for ``event``: built in, or the organizer has a default"""
+    return template_type in DEFAULT_TEMPLATES or find_email_template(event, template_type) is not None
+
+
+def email_templates(event, template_type='invitation', email_template=None):
+    """
+    Compiled templates for an email about ``event``: ``email_template`` if
+    given, else the organizer's default of the type, else the built-in one.
+    """
+    if email_template is None:
+        email_template = find_email_template(event, template_type)
+    if email_template is not None:
+        return compiled_email_template(email_template)
+    return default_email_templates(template_type)
+
+
+def guest_values(invitation, rsvp_url, qr_image_url, open_pixel_url=None):
+    """Per-guest values for an invitation email"""
+    guest = invitation.guest
+    return {
+        'first_name': guest.first_name,
+        'last_name': guest.last_name,
+        'full_name': guest.full_name,
+        'rsvp_url': rsvp_url,
+        'qr_image_url': qr_image_url or '',
+        'open_pixel_url': open_pixel_url or '',
+    }
+
+
+def render_invitation_templates(invitation, rsvp_url, qr_image_url, templates=None, open_pixel_url=None):
+    """Render the subject and bodies for one guest without the cache"""
+    templates = templates or default_email_templates()
+    return templates.render({
+        'invitation': invitation,
+        'rsvp_url': rsvp_url,
+        'qr_image_url': qr_image_url,
+        'open_pixel_url': open_pixel_url,
+    })
+
+
+class _PerGuestValue(Exception):
+    """A template used a guest value that has no marker"""
+
+
+class _Placeholder(SimpleNamespace):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        raise _PerGuestValue(name)
+
+
+class EventEmailRender:
+    """An event's email templates pre-rendered, with guest fields left open"""
+
+    def __init__(self, event, with_qr, templates, with_pixel=False):
+        guest = _Placeholder(
+            first_name=_MARKERS['first_name'],
+            last_name=_MARKERS['last_name'],
+            full_name=_MARKERS['full_name'],
+        )
+        context = {
+            'invitation': _Placeholder(event=event, guest=guest),
+            'rsvp_url': _MARKERS['rsvp_url'],
+            # Whether there is a QR image or tracking pixel is the same for a whole send job
+            'qr_image_url': _MARKERS['qr_image_url'] if with_qr else None,
+            'open_pixel_url': _MARKERS['open_pixel_url'] if with_pixel else None,
+        }
+        try:
+            rendered_parts = templates.render(context)
+        except _PerGuestValue as e:
+            raise ValueError(f'Templates use the per-guest value {e} and cannot be cached') from None
+        self.parts = []
+        for rendered, escape in zip(rendered_parts, ESCAPE_PARTS):
+            pieces = _MARKER_PATTERN.split(rendered)
+            # A filtered guest field (e.g. |upper) would leave a mangled marker behind
+            if rendered.lower().count(_MARKER_PREFIX) != len(pieces) // 2:
+                raise ValueError('Templates apply filters to guest fields and cannot be cached')
+            self.parts.append((escape, [(piece in _FIELD_BY_MARKER, _FIELD_BY_MARKER.get(piece, piece))
+                                        for piece in pieces]))
+
+    def render(self, values):
+        """Fill in one guest's values; returns the subject, HTML and text"""
+        escaped = {field: conditional_escape(value) for field, value in values.items()}
+        return [
+            ''.join((escaped if escape else values)[piece] if is_field else piece for is_field, piece in parts)
+            for escape, parts in self.parts
+        ]
+
+
+def event_render(event, with_qr, templates=None, with_pixel=False):
+    """
+    The cached render of an event's email templates, or None if the
+    templates cannot be pre-rendered.
+    """
+    templates = templates or default_email_templates()
+    key = (event.pk, event.updated_at, with_qr, with_pixel, templates.key)
+    with _lock:
+        if key in _renders:
+            _renders.move_to_end(key)
+            return _renders[key]
+    try:
+        render = EventEmailRender(event, with_qr, templates, with_pixel)
+    except ValueError:
+        render = None
+    with _lock:
+        _renders[key] = render
+        while len(_renders) > MAX_CACHED_RENDERS:
+            _renders.popitem(last=False)
+    return render
+
+
+def render_invitation_email(invitation, rsvp_url, qr_image_url, templates=None, open_pixel_url=None):
+    """Render the subject, HTML and plain text bodies of an email"""
+    templates = templates or default_email_templates()
+    render = event_render(invitation.event, bool(qr_image_url), templates, bool(open_pixel_url))
+    if render is None:
+        return render_invitation_templates(invitation, rsvp_url, qr_image_url, templates, open_pixel_url)
+    return render.render(guest_values(invitation, rsvp_url, qr_image_url, open_pixel_url))
+
+
+def invalidate_event_renders(sender, instance, **kwargs):
+    """Signal receiver: drop cached renders of a saved or deleted event"""
+    with _lock:
+        for key in [key for key in _renders if key[0] == instance.pk]:
+            del _renders[key]
+
+
+def clear_render_cache():
+    with _lock:
+        _renders.clear()
+        _compiled.clear()
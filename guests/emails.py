@@ -0,0 +1,391 @@
+"""
+Invitation emails.
+
+Bulk sends are never done inside a web request: the invitations are marked
+'queued' (reminders keep their status) and attached to a SendJob, which is then sent by a Celery worker
+when CELERY_BROKER_URL is set, or by the process_send_jobs command (the
+database acts as the queue) otherwise.
+
+A job works through its invitations in primary key order, one chunk at a
+time, and records a checkpoint after every chunk. Pausing or cancelling takes
+effect at the next chunk, and a paused or interrupted job resumes from its
+checkpoint.
+"""
+import datetime
+import logging
+from collections import Counter
+
+from email.mime.nonmultipart import MIMENonMultipart
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.urls import reverse
+from django.utils import timezone
+
+from .codes import encoded_code_image, qr_payload
+from .email_rendering import can_send, email_templates, render_invitation_email
+from .mail_scheduler import MailScheduler
+from .models import Invitation, SendJob
+from .tracking import increment_analytics
+
+logger = logging.getLogger(__name__)
+
+# Send outcomes are written to the database this many at a time
+STATUS_CHUNK_SIZE = 200
+
+
+def absolute_url(path, request=None, base_url=''):
+    """Make a site path absolute using the request, or a stored base URL"""
+    if request is not None:
+        return request.build_absolute_uri(path)
+    return f'{base_url.rstrip("/")}{path}' if base_url else path
+
+
+def inline_qr_code(invitation):
+    """The guest's QR code as an inline image part, and its Content-ID"""
+    content_id = f'qr-{invitation.unique_code}@guest-tracker'
+    part = MIMENonMultipart('image', 'png')
+    # Already base64-encoded (and cached), so it is not encoded per message
+    part.set_payload(encoded_code_image('qr', qr_payload(invitation.unique_code)))
+    part['Content-Transfer-Encoding'] = 'base64'
+    part['Content-ID'] = f'<{content_id}>'
+    part['Content-Disposition'] = 'inline; filename="qr_code.png"'
+    return part, content_id
+
+
+def build_invitation_message(invitation, request=None, base_url='', connection=None, include_qr_code=False,
+                             templates=None):
+    """
+    Build the email for a guest without sending it. ``templates`` are the
+    compiled templates to use (see email_templates); by default the event's
+    invitation templates.
+    """
+    if templates is None:
+        templates = email_templates(invitation.event)
+
+    # Create RSVP URL
+    rsvp_url = absolute_url(invitation.get_rsvp_url(), request, base_url)
+    open_pixel_url = None
+    if settings.EMAIL_TRACKING and (request is not None or base_url):
+        # The RSVP link goes through the click counter, which redirects to it
+        rsvp_url = absolute_url(reverse('track_click', args=[invitation.unique_code]), request, base_url)
+        open_pixel_url = absolute_url(reverse('track_open', args=[invitation.unique_code]), request, base_url)
+    qr_image_url = qr_part = None
+    if include_qr_code:
+        qr_part, content_id = inline_qr_code(invitation)
+        qr_image_url = f'cid:{content_id}'
+    elif request is not None or base_url:
+        # Email clients do not reliably display SVG
+        qr_image_url = absolute_url(invitation.get_qr_code_url('png'), request, base_url)
+
+    # Event details are rendered once per event; only guest fields vary
+    subject, html_message, plain_message = render_invitation_email(
+        invitation, rsvp_url, qr_image_url, templates, open_pixel_url
+    )
+
+    message = EmailMultiAlternatives(
+        subject=subject,
+        body=plain_message,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[invitation.guest.email],
+        connection=connection,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    if qr_part is not None:
+        # multipart/related, so clients show the image in the HTML body
+        message.mixed_subtype = 'related'
+        message.attach(qr_part)
+    return message
+
+
+def send_invitation_email(invitation, request=None, base_url='', include_qr_code=None):
+    """Send invitation email to a guest"""
+    if include_qr_code is None:
+        include_qr_code = settings.EMAIL_INCLUDE_QR_CODE
+    build_invitation_message(invitation, request, base_url, include_qr_code=include_qr_code).send()
+
+
+def send_invitation_batches(invitations, base_url='', scheduler=None, include_qr_code=False, templates=None):
+    """
+    Send invitation emails through a rate-limited MailScheduler.
+
+    Yields ``(invitation, error)`` for every invitation as it completes, with
+    ``error`` None when the email was sent. Each scheduler worker keeps its
+    SMTP connection open for EMAIL_BATCH_SIZE messages. Messages, including
+    any inline QR images, are built here while the workers talk SMTP.
+    ``templates`` default to each event's invitation templates.
+    """
+    scheduler = scheduler or MailScheduler()
+    build_errors = []
+
+    def messages():
+        for invitation in invitations:
+            try:
+                yield invitation, build_invitation_message(
+                    invitation, base_url=base_url, include_qr_code=include_qr_code,
+                    templates=templates,
+                )
+            except Exception as e:
+                build_errors.append((invitation, e))
+
+    for result in scheduler.send(messages()):
+        yield from build_errors
+        build_errors.clear()
+        yield result
+    yield from build_errors
+    logger.info(f"Delivered {scheduler.stats.sent} email(s), {scheduler.stats.failed} failed, "
+                f"{scheduler.stats.messages_per_second:.1f} msg/s")
+
+
+def record_send_results(results, chunk_size=STATUS_CHUNK_SIZE, reminder=False):
+    """
+    Pass ``(invitation, error)`` results through, saving the outcomes in
+    batches: one UPDATE for the sent and one for the failed invitations of
+    each chunk, instead of a save() per invitation, plus one increment of
+    each event's emails_sent. With ``reminder`` only the sent invitations'
+    reminder counts change: a reminder does not alter an invitation's status
+    or when it was first sent. Outcomes still buffered are saved even if the
+    caller stops early.
+    """
+    sent, failed = [], []
+    sent_per_event = Counter()
+
+    def flush():
+        if sent:
+            now = timezone.now()
+            if reminder:
+                fields = {'reminder_count': F('reminder_count') + 1, 'last_reminder_at': now}
+            else:
+                fields = {'status': 'sent', 'email_sent': True, 'email_sent_at': now}
+            Invitation.objects.filter(pk__in=sent).update(**fields)
+        if failed and not reminder:
+            Invitation.objects.filter(pk__in=failed).update(status='failed')
+        for event_id, count in sent_per_event.items():
+            increment_analytics(event_id, emails_sent=count)
+        sent.clear()
+        failed.clear()
+        sent_per_event.clear()
+
+    try:
+        for invitation, error in results:
+            (sent if error is None else failed).append(invitation.pk)
+            if error is None:
+                sent_per_event[invitation.event_id] += 1
+            yield invitation, error
+            if len(sent) + len(failed) >= chunk_size:
+                flush()
+    finally:
+        flush()
+
+
+def queue_invitation_emails(event, invitations, user=None, request=None, base_url='', dispatch=True,
+                            include_qr_code=None, email_type='invitation', template=None):
+    """
+    Queue emails for a queryset of an event's invitations.
+
+    Returns the new SendJob, or None if there was nothing to send. Guests
+    whose email bounced are skipped. Reminders leave the invitations' status
+    alone; they only join the job. With
+    ``dispatch=False`` the caller runs the job itself. QR codes are embedded
+    per EMAIL_INCLUDE_QR_CODE unless ``include_qr_code`` is given. The emails
+    use ``template``, or the organizer's default EmailTemplate of
+    ``email_type`` when the job runs. Raises ValueError for a type that has
+    neither and would fail every email.
+    """
+    if template is None and not can_send(event, email_type):
+        raise ValueError(f'There is no {email_type} email template; create a default one first')
+    if template is not None and template.template_type != email_type:
+        raise ValueError(f'{template} is a {template.get_template_type_display().lower()} template, '
+                         f'not {email_type}')
+    if request is not None:
+        base_url = request.build_absolute_uri('/')
+    base_url = base_url or settings.SITE_URL
+    if include_qr_code is None:
+        include_qr_code = settings.EMAIL_INCLUDE_QR_CODE
+    # Addresses that bounced are suppressed
+    invitations = invitations.filter(guest__email_bounced_at__isnull=True)
+    with transaction.atomic():
+        job = SendJob.objects.create(
+            event=event, created_by=user, base_url=base_url.rstrip('/'), include_qr_code=include_qr_code,
+            email_type=email_type, template=template,
+        )
+        fields = {'send_job': job} if email_type == 'reminder' else {'status': 'queued', 'send_job': job}
+        total = invitations.update(**fields)
+        if not total:
+            job.delete()
+            return None
+        job.total = total
+        job.save(update_fields=['total'])
+        if dispatch:
+            dispatch_send_job(job)
+    logger.info(f"Queued {total} {email_type} email(s) for event {event.id} as send job {job.pk}")
+    return job
+
+
+def dispatch_send_job(job):
+    """Hand a queued job to Celery when a broker is configured"""
+    if not settings.CELERY_BROKER_URL:
+        # Left in the database for the process_send_jobs worker
+        return
+    from .tasks import send_invitation_job
+
+    def enqueue():
+        try:
+            send_invitation_job.delay(job.pk)
+        except Exception as e:
+            logger.error(f"Could not enqueue send job {job.pk}, leaving it for process_send_jobs: {e}")
+
+    transaction.on_commit(enqueue)
+
+
+def claim_send_job(job_id, statuses=('queued',), stale_after=None):
+    """
+    Mark a job as running; returns None if another worker has it. With
+    ``stale_after`` (seconds), a running job whose last heartbeat is older
+    than that is taken over too: its run was killed without pausing it.
+    """
+    now = timezone.now()
+    claimable = Q(status__in=statuses)
+    if stale_after is not None:
+        claimable |= Q(status='running') & (
+            Q(heartbeat_at__lt=now - datetime.timedelta(seconds=stale_after)) | Q(heartbeat_at__isnull=True)
+        )
+    claimed = SendJob.objects.filter(claimable, pk=job_id).update(
+        status='running', started_at=now, finished_at=None, heartbeat_at=now,
+        processed_at_start=F('sent_count') + F('failed_count'),
+    )
+    if not claimed:
+        return None
+    return SendJob.objects.select_related('event', 'template').get(pk=job_id)
+
+
+def pause_send_job(job_id):
+    """Ask a job to stop after its current chunk; returns False if it is not active"""
+    return bool(SendJob.objects.filter(pk=job_id, status__in=('queued', 'running')).update(status='paused'))
+
+
+def resume_send_job(job_id, dispatch=True):
+    """Queue a paused or failed job again; it continues from its checkpoint"""
+    resumed = SendJob.objects.filter(pk=job_id, status__in=('paused', 'failed')).update(
+        status='queued', error=''
+    )
+    if resumed and dispatch:
+        dispatch_send_job(SendJob.objects.get(pk=job_id))
+    return bool(resumed)
+
+
+def cancel_send_job(job_id):
+    """
+    Stop a job for good. Invitations it has not sent go back to their
+    previous state ('sent' if an earlier email reached the guest).
+    """
+    with transaction.atomic():
+        cancelled = SendJob.objects.filter(pk=job_id).exclude(
+            status__in=('completed', 'cancelled')
+        ).update(status='cancelled', finished_at=timezone.now())
+        if not cancelled:
+            return False
+        Invitation.objects.filter(send_job_id=job_id, status='queued').update(
+            status=Case(When(email_sent=True, then=Value('sent')), default=Value('draft'))
+        )
+    logger.info(f"Send job {job_id} cancelled")
+    return True
+
+
+def job_chunks(job, chunk_size):
+    """
+    Yield lists of a job's queued invitations after its checkpoint.
+
+    Keyset pagination keeps each query cheap and memory bounded however
+    large the job is. The job's status is re-read before every chunk, so a
+    pause or cancel from another process stops the run. A reminder job takes
+    the invitations that have had no reminder since it was queued.
+    """
+    if job.email_type == 'reminder':
+        pending = job.invitations.filter(Q(last_reminder_at__isnull=True) | Q(last_reminder_at__lt=job.created_at))
+    else:
+        pending = job.invitations.filter(status='queued')
+    last_pk = job.last_invitation_id
+    while True:
+        status = SendJob.objects.filter(pk=job.pk).values_list('status', flat=True).first()
+        if status != 'running':
+            logger.info(f"Send job {job.pk} is {status}; stopping after invitation {last_pk}")
+            return
+        chunk = list(pending.filter(pk__gt=last_pk).select_related('guest', 'event').order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def run_send_job(job, chunk_size=STATUS_CHUNK_SIZE, progress=None):
+    """
+    Send the emails still queued for a claimed job, checkpointing after
+    every chunk. ``progress`` is called with the job after each checkpoint.
+    Returns the job's (sent, failed) totals.
+    """
+    sent, failed = job.sent_count, job.failed_count
+    scheduler = MailScheduler()
+    finished = False
+    try:
+        # Compiled once per run; an edited template is picked up by the next run
+        templates = email_templates(job.event, job.email_type, job.template)
+        for chunk in job_chunks(job, chunk_size):
+            results = send_invitation_batches(chunk, job.base_url, scheduler, job.include_qr_code, templates)
+            for invitation, error in record_send_results(results, chunk_size, job.email_type == 'reminder'):
+                if error is not None:
+                    failed += 1
+                    logger.error(f"Send job {job.pk}: failed to send invitation {invitation.pk} "
+                                 f"to {invitation.guest.email}: {error}")
+                else:
+                    sent += 1
+            job.last_invitation_id = chunk[-1].pk
+            job.sent_count, job.failed_count = sent, failed
+            SendJob.objects.filter(pk=job.pk).update(
+                last_invitation_id=job.last_invitation_id, sent_count=sent, failed_count=failed,
+                heartbeat_at=timezone.now(),
+            )
+            if progress:
+                progress(job)
+        else:
+            finished = True
+    except KeyboardInterrupt:
+        # Outcomes of the interrupted chunk were saved; keep the counts in step
+        SendJob.objects.filter(pk=job.pk).update(sent_count=sent, failed_count=failed)
+        raise
+    except Exception as e:
+        logger.exception(f"Send job {job.pk} stopped after invitation {job.last_invitation_id}")
+        SendJob.objects.filter(pk=job.pk).update(
+            status='failed', sent_count=sent, failed_count=failed, error=str(e),
+            finished_at=timezone.now(),
+        )
+        raise
+    if finished and SendJob.objects.filter(pk=job.pk, status='running').update(
+        status='completed', finished_at=timezone.now()
+    ):
+        job.status = 'completed'
+        logger.info(f"Send job {job.pk} finished: {sent} sent, {failed} failed")
+    else:
+        job.refresh_from_db(fields=['status'])
+    return sent, failed
+
+
+def process_send_job(job_id):
+    """Claim and run one job; returns (sent, failed) or None if not claimable"""
+    job = claim_send_job(job_id)
+    if job is None:
+        return None
+    return run_send_job(job)
+
+
+def process_queued_send_jobs():
+    """Run every queued job, oldest first; returns the number of jobs run"""
+    processed = 0
+    for job_id in SendJob.objects.filter(status='queued').order_by('created_at').values_list('pk', flat=True):
+        if process_send_job(job_id) is not None:
+            processed += 1
+    return processed
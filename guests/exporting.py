@@ -0,0 +1,171 @@
+"""
+Guest roster export.
+
+Rosters are read from the database with ``iterator(chunk_size)`` and written
+as they are read: Parquet one row group per chunk (pyarrow), XLSX through a
+write-only workbook (openpyxl), CSV row by row. Memory use is bounded by the
+chunk size, not the number of guests.
+
+An event's guest list with RSVPs is also streamed as CSV or TSV for
+download: the invitations, their guests and RSVPs are read in one joined
+query, chunk by chunk, and rows are sent in blocks as soon as they are
+formatted, so a download starts at once however long the list is.
+"""
+import csv
+import io
+import re
+import uuid
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .importing import IMPORT_FIELDS, guess_format
+from .models import RSVP, Guest
+
+EXPORT_FORMATS = ('csv', 'xlsx', 'parquet')
+
+GUEST_LIST_FORMATS = {'csv': ('text/csv', ','), 'tsv': ('text/tab-separated-values', '\t')}
+GUEST_LIST_CHUNK_SIZE = 2000
+# Rows formatted before a block is sent
+GUEST_LIST_BLOCK_SIZE = 200
+
+# (header, lookup) of the guest list download
+GUEST_LIST_COLUMNS = (
+    ('First name', 'guest__first_name'),
+    ('Last name', 'guest__last_name'),
+    ('Email', 'guest__email'),
+    ('Phone', 'guest__phone'),
+    ('Invitation status', 'status'),
+    ('RSVP', 'rsvp__response'),
+    ('Plus-ones', 'rsvp__plus_ones'),
+    ('Dietary restrictions', 'rsvp__dietary_restrictions'),
+    ('Special requests', 'rsvp__special_requests'),
+    ('Responded at', 'rsvp__responded_at'),
+    ('Table', 'table_number'),
+    ('Seat', 'seat_number'),
+    ('Checked in', 'checked_in'),
+    ('Check-in time', 'check_in_time'),
+)
+
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+NUMBER_LIKE = re.compile(r'[+-]?[\d\s().-]+')
+
+# Columns added to the guest fields when exporting an event's invitations
+INVITATION_COLUMNS = (
+    ('unique_code', 'unique_code'),
+    ('status', 'status'),
+    ('rsvp', 'rsvp__response'),
+    ('table_number', 'table_number'),
+    ('seat_number', 'seat_number'),
+    ('checked_in', 'checked_in'),
+)
+
+
+def roster(event=None):
+    """
+    The columns and a queryset of value tuples of all guests, or of the
+    guests invited to ``event`` with their invitation details.
+    """
+    if event is None:
+        return IMPORT_FIELDS, Guest.objects.order_by('pk').values_list(*IMPORT_FIELDS)
+    columns = IMPORT_FIELDS + tuple(column for column, _ in INVITATION_COLUMNS)
+    lookups = [f'guest__{name}' for name in IMPORT_FIELDS] + [lookup for _, lookup in INVITATION_COLUMNS]
+    return columns, event.invitations.order_by('pk').values_list(*lookups)
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def write_csv(path, columns, rows, chunk_size=2000):
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for chunk in _chunks(rows, chunk_size):
+            writer.writerows(chunk)
+
+
+def write_xlsx(path, columns, rows, chunk_size=2000):
+    # A write-only workbook streams rows to a temporary file as they are appended
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Guests')
+    worksheet.append(list(columns))
+    for row in rows:
+        worksheet.append([str(value) if isinstance(value, uuid.UUID) else value for value in row])
+    workbook.save(path)
+
+
+def write_parquet(path, columns, rows, chunk_size=10000):
+    """Write rows as Parquet, one row group per ``chunk_size`` rows"""
+    schema = pa.schema([(name, pa.bool_() if name == 'checked_in' else pa.string()) for name in columns])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in _chunks(rows, chunk_size):
+            arrays = [
+                pa.array([value if value is None or isinstance(value, bool) else str(value) for value in column],
+                         type=schema_field.type)
+                for schema_field, column in zip(schema, zip(*chunk))
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=chunk_size)
+
+
+def export_roster(path, event=None, file_format=None, chunk_size=10000):
+    """Write the guest roster to a CSV, XLSX or Parquet file; returns the number of rows"""
+    writers = {'csv': write_csv, 'xlsx': write_xlsx, 'parquet': write_parquet}
+    write = writers[file_format or guess_format(path)]
+    columns, queryset = roster(event)
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    write(path, columns, counted(queryset.iterator(chunk_size=chunk_size)), chunk_size=chunk_size)
+    return count
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if hasattr(value, 'tzinfo'):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M')
+    value = str(value)
+    if value.startswith(FORMULA_PREFIXES) and not NUMBER_LIKE.fullmatch(value):
+        # Guests type some of these fields; keep them from running as formulas
+        return f"'{value}"
+    return value
+
+
+def guest_list_rows(event, chunk_size=GUEST_LIST_CHUNK_SIZE):
+    """The rows of an event's guest list with RSVPs, read ``chunk_size`` invitations at a time"""
+    responses = dict(RSVP.RESPONSE_CHOICES)
+    invitations = event.invitations.order_by('guest__last_name', 'guest__first_name', 'pk').values_list(
+        *[lookup for _, lookup in GUEST_LIST_COLUMNS]
+    )
+    response_index = [lookup for _, lookup in GUEST_LIST_COLUMNS].index('rsvp__response')
+    for values in invitations.iterator(chunk_size=chunk_size):
+        row = [_cell(value) for value in values]
+        row[response_index] = responses.get(values[response_index], 'No response')
+        yield row
+
+
+def stream_guest_list(event, delimiter=',', chunk_size=GUEST_LIST_CHUNK_SIZE, block_size=GUEST_LIST_BLOCK_SIZE):
+    """Yield an event's guest list as delimited text, a block of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    writer.writerow([header for header, _ in GUEST_LIST_COLUMNS])
+    yield buffer.getvalue()
+    for block in _chunks(guest_list_rows(event, chunk_size), block_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(block)
+        yield buffer.getvalue()
@@ -211,6 +211,21 @@ class EmailTemplateForm(forms.ModelForm):
             'html_content': forms.Textarea(attrs={'class': 'form-control', 'rows': 10}),
             'text_content': forms.Textarea(attrs={'class': 'form-control', 'rows': 6}),
         }
+    
+    def clean(self):
+        """Reject templates that would fail to compile when sending"""
+        from django.template import TemplateSyntaxError
+        from .email_rendering import compile_email_template
+        
+        cleaned_data = super().clean()
+        if not self.errors:
+            try:
+                compile_email_template(EmailTemplate(**{
+                    name: cleaned_data.get(name, '') for name in ('subject', 'html_content', 'text_content')
+                }))
+            except TemplateSyntaxError as e:
+                raise forms.ValidationError(f'Invalid template syntax: {str(e)}')
+        return cleaned_data
 
 class BulkEmailForm(forms.Form):
     """Form for sending bulk emails"""
@@ -0,0 +1,159 @@
+"""
+Bulk guest import.
+
+Rows are read as a stream from CSV, XLSX (openpyxl, read-only mode) or
+Parquet (pyarrow, one batch at a time) files and handled in chunks. For each chunk the guests
+that already exist are looked up in one query on the ``unique_together`` key
+(first name, last name, email); the new ones are inserted with
+``bulk_create`` and the chunk's invitations with ``bulk_invite``. Memory use
+is bounded by the chunk size, not the size of the file.
+"""
+import csv
+import datetime
+import os
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+from .models import Guest, Invitation
+
+# Expected columns
+IMPORT_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'address')
+
+IMPORT_FORMATS = ('csv', 'xlsx', 'parquet')
+FORMAT_EXTENSIONS = {'.xlsx': 'xlsx', '.xlsm': 'xlsx', '.parquet': 'parquet', '.pq': 'parquet'}
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    guests_created: int = 0
+    guests_existing: int = 0
+    invitations_created: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+
+def guess_format(path):
+    """The import format of a file, from its extension"""
+    return FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def cell_text(value):
+    """A spreadsheet or Parquet value as the text a CSV file would hold"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Phone numbers typed into a spreadsheet come back as floats
+        return str(int(value))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def read_csv(file):
+    """Yield the rows of an open CSV file as dicts"""
+    yield from csv.DictReader(file)
+
+
+def read_csv_file(path):
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        yield from read_csv(file)
+
+
+def read_xlsx(path):
+    """Yield the rows of the first worksheet of an XLSX file as dicts, one row at a time"""
+    # Read-only mode parses the sheet XML as it is iterated instead of loading it
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [cell_text(value).strip() for value in next(rows, ())]
+        for values in rows:
+            if any(value is not None for value in values):
+                yield dict(zip(header, map(cell_text, values)))
+    finally:
+        workbook.close()
+
+
+def read_parquet(path, batch_size=10000):
+    """Yield the rows of a Parquet file as dicts, reading one batch of a row group at a time"""
+    parquet_file = pq.ParquetFile(path)
+    columns = [name for name in IMPORT_FIELDS if name in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        for row in batch.to_pylist():
+            yield {name: cell_text(value) for name, value in row.items()}
+
+
+def read_rows(path, file_format=None):
+    """Yield the rows of a CSV, XLSX or Parquet file as dicts"""
+    readers = {'csv': read_csv_file, 'xlsx': read_xlsx, 'parquet': read_parquet}
+    return readers[file_format or guess_format(path)](path)
+
+
+def clean_row(row):
+    return {name: (row.get(name) or '').strip() for name in IMPORT_FIELDS}
+
+
+def guest_key(values):
+    return values['first_name'], values['last_name'], values['email']
+
+
+def existing_guest_ids(keys):
+    """Map the keys of a chunk that are already in the database to guest ids"""
+    if not keys:
+        return {}
+    # first_name leads the unique_together index
+    candidates = Guest.objects.filter(
+        first_name__in={key[0] for key in keys}, email__in={key[2] for key in keys}
+    ).values_list('first_name', 'last_name', 'email', 'pk')
+    return {
+        (first_name, last_name, email): pk
+        for first_name, last_name, email, pk in candidates
+        if (first_name, last_name, email) in keys
+    }
+
+
+def import_guest_rows(rows, event=None, chunk_size=1000, batch_size=500, progress=None):
+    """
+    Import guests from an iterable of row dicts; invite them to ``event`` if
+    given. ``progress`` is called with the ImportResult after every chunk.
+    """
+    result = ImportResult()
+    already_invited = None
+    if event is not None:
+        already_invited = set(event.invitations.values_list('guest_id', flat=True))
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        result.rows += len(chunk)
+        values = [clean_row(row) for row in chunk]
+        existing = existing_guest_ids({guest_key(row) for row in values})
+
+        new_guests = {}
+        for row in values:
+            key = guest_key(row)
+            if key not in existing and key not in new_guests:
+                new_guests[key] = Guest(**row)
+        created = Guest.objects.bulk_create(new_guests.values(), batch_size=batch_size)
+        if created and created[0].pk is None:
+            # Backends that cannot return ids from a bulk insert
+            existing.update(existing_guest_ids(set(new_guests)))
+        else:
+            existing.update(((guest.first_name, guest.last_name, guest.email), guest.pk) for guest in created)
+        result.guests_created += len(created)
+        result.guests_existing += len(values) - len(created)
+
+        if event is not None:
+            guest_ids = [existing[guest_key(row)] for row in values]
+            result.invitations_created += len(Invitation.objects.bulk_invite(
+                event, guest_ids, batch_size=batch_size, already_invited=already_invited
+            ))
+        if progress:
+            progress(result)
+    return result
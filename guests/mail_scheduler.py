@@ -0,0 +1,257 @@
+"""
+Rate-limited concurrent email delivery.
+
+A MailScheduler sends messages from a bounded pool of worker threads, each
+holding its own SMTP connection. Every message first takes a token from the
+shared rate limiter (messages per second and per hour). Temporary (4xx)
+rejections pause the whole pool with exponential backoff before the message
+is retried, so a throttling provider slows us down instead of failing the
+run. Messages are built by the caller's thread; the workers only talk SMTP.
+"""
+import logging
+import queue
+import random
+import smtplib
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the SMTP connection is reopened and the message retried
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take a token, returning how long to wait before it may be used"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Messages-per-second and messages-per-hour limits, plus pool-wide pauses"""
+
+    def __init__(self, per_second=0, per_hour=0):
+        self.buckets = []
+        if per_second:
+            self.buckets.append(TokenBucket(per_second))
+        if per_hour:
+            self.buckets.append(TokenBucket(per_hour / 3600, capacity=per_hour))
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a message may be sent"""
+        wait = max([bucket.reserve() for bucket in self.buckets], default=0)
+        with self.lock:
+            wait = max(wait, self.paused_until - time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every worker for at least ``seconds``"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+@dataclass
+class SendStats:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, error=None, retry=False):
+        with self.lock:
+            if retry:
+                self.retries += 1
+            elif error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def messages_per_second(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'seconds': round(self.elapsed, 3),
+            'messages_per_second': round(self.messages_per_second, 2),
+        }
+
+
+def is_temporary_failure(error):
+    """True for 4xx SMTP replies, which are worth retrying later"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and 400 <= error.smtp_code < 500
+
+
+class MailScheduler:
+    """
+    Send messages concurrently within the configured rate limits.
+
+    Defaults come from the EMAIL_SEND_WORKERS, EMAIL_RATE_PER_SECOND,
+    EMAIL_RATE_PER_HOUR, EMAIL_BATCH_SIZE (messages per SMTP session),
+    EMAIL_MAX_RETRIES and EMAIL_BACKOFF_SECONDS settings.
+    """
+
+    def __init__(self, workers=None, per_second=None, per_hour=None, batch_size=None,
+                 max_retries=None, backoff=None, connection_factory=get_connection):
+        self.workers = max(1, workers or settings.EMAIL_SEND_WORKERS)
+        self.limiter = RateLimiter(
+            settings.EMAIL_RATE_PER_SECOND if per_second is None else per_second,
+            settings.EMAIL_RATE_PER_HOUR if per_hour is None else per_hour,
+        )
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.max_retries = settings.EMAIL_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.EMAIL_BACKOFF_SECONDS if backoff is None else backoff
+        self.connection_factory = connection_factory
+        self.stats = SendStats()
+
+    def send(self, items):
+        """
+        Send ``(key, message)`` pairs; yields ``(key, error)`` as they finish.
+
+        ``error`` is None for a delivered message. Results come back in
+        completion order, and only a few messages per worker are queued at
+        a time, so ``items`` can be a lazy stream.
+        """
+        tasks = queue.Queue(maxsize=self.workers * 2)
+        results = queue.Queue()
+        threads = [
+            threading.Thread(target=self._worker, args=(tasks, results), daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        pending = 0
+        try:
+            for item in items:
+                while True:
+                    try:
+                        tasks.put(item, timeout=0.05)
+                        break
+                    except queue.Full:
+                        pass
+                    while not results.empty():
+                        pending -= 1
+                        yield results.get()
+                pending += 1
+                while not results.empty():
+                    pending -= 1
+                    yield results.get()
+            while pending:
+                pending -= 1
+                yield self._next_result(results, threads)
+        finally:
+            # One stop marker per worker; give up once no worker is left to take them
+            stops = len(threads)
+            while stops and any(thread.is_alive() for thread in threads):
+                try:
+                    tasks.put(None, timeout=0.05)
+                    stops -= 1
+                except queue.Full:
+                    pass
+            for thread in threads:
+                thread.join()
+            self.stats.finished = time.monotonic()
+
+    @staticmethod
+    def _next_result(results, threads):
+        while True:
+            try:
+                return results.get(timeout=0.5)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in threads) and results.empty():
+                    raise RuntimeError('All mail workers stopped with messages still pending') from None
+
+    def _worker(self, tasks, results):
+        session = {'open': False, 'sent': 0}
+        try:
+            connection, setup_error = self.connection_factory(), None
+        except Exception as e:
+            connection, setup_error = None, e
+        try:
+            while (item := tasks.get()) is not None:
+                key, message = item
+                try:
+                    error = setup_error or self._send(connection, session, message)
+                except Exception as e:
+                    # Every message gets a result, or send() would wait for it forever
+                    error = e
+                self.stats.record(error)
+                results.put((key, error))
+        finally:
+            if session['open']:
+                self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        """Close an SMTP connection that may already be broken"""
+        try:
+            connection.close()
+        except Exception as e:
+            logger.warning(f"Could not close SMTP connection cleanly: {e}")
+
+    def _send(self, connection, session, message):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                if session['open'] and session['sent'] >= self.batch_size:
+                    # Start a new SMTP session every batch_size messages
+                    self._close(connection)
+                    session['open'] = False
+                if not session['open']:
+                    connection.open()
+                    session.update(open=True, sent=0)
+                connection.send_messages([message])
+                session['sent'] += 1
+                return None
+            except CONNECTION_ERRORS as e:
+                error = e
+                logger.warning(f"SMTP connection lost ({e}), reconnecting")
+                self._close(connection)
+                session['open'] = False
+            except Exception as e:
+                if not is_temporary_failure(e):
+                    return e
+                error = e
+                delay = min(self.backoff * 2 ** attempt, 300) * random.uniform(0.8, 1.2)
+                logger.warning(f"SMTP server deferred a message ({e}); backing off {delay:.1f}s")
+                self.limiter.pause(delay)
+            if attempt < self.max_retries:
+                self.stats.record(retry=True)
+        return error
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from guests.benchmarks import benchmark_code_rendering
+
+class Command(BaseCommand):
+    help = 'Compare render time and size of PNG and SVG invitation codes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Codes to render per kind and format')
+
+    def handle(self, *args, **options):
+        results = benchmark_code_rendering(options['count'])
+
+        self.stdout.write(f'{"Kind":<8} {"Format":<7} {"ms/code":>9} {"codes/s":>9} {"bytes/code":>11}')
+        for row in results:
+            self.stdout.write(
+                f'{row["kind"]:<8} {row["format"]:<7} {row["ms_per_code"]:>9} '
+                f'{row["codes_per_second"]:>9} {row["bytes_per_code"]:>11}'
+            )
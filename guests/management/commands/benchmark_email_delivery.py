@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from guests.benchmarks import benchmark_email_delivery
+
+class Command(BaseCommand):
+    help = ('Measure messages/second through the rate-limited mail scheduler. '
+            'Point EMAIL_HOST/EMAIL_PORT at a local SMTP stand-in first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Messages to send')
+        parser.add_argument('--workers', type=int, help='Concurrent SMTP connections (default: EMAIL_SEND_WORKERS)')
+        parser.add_argument('--rate', type=float, help='Messages per second limit, 0 for none (default: EMAIL_RATE_PER_SECOND)')
+        parser.add_argument('--hourly', type=int, help='Messages per hour limit, 0 for none (default: EMAIL_RATE_PER_HOUR)')
+        parser.add_argument('--batch-size', type=int, help='Messages per SMTP session (default: EMAIL_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Sending {options["count"]} messages via {settings.EMAIL_BACKEND}')
+        result = benchmark_email_delivery(
+            options['count'],
+            workers=options['workers'],
+            per_second=options['rate'],
+            per_hour=options['hourly'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{result["sent"]} sent, {result["failed"]} failed, {result["retries"]} retries '
+                f'with {result["workers"]} worker(s) in {result["seconds"]}s: '
+                f'{result["messages_per_second"]} msg/s'
+            )
+        )
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from guests.benchmarks import PIPELINE_BENCHMARKS, PIPELINE_SIZES, benchmark_pipeline, throwaway_database
+import json
+
+class Command(BaseCommand):
+    help = 'Benchmark invitation creation, guest import and code generation and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(PIPELINE_SIZES),
+                          help='Row counts to run each benchmark at (default: 1000 10000 100000)')
+        parser.add_argument('--only', nargs='+', choices=list(PIPELINE_BENCHMARKS),
+                          help='Run only these benchmarks')
+        parser.add_argument('--output', type=str, default='benchmark_results.json',
+                          help='JSON file to write the results to')
+        parser.add_argument('--label', type=str, default='',
+                          help='Label stored with the results, e.g. a commit hash')
+        parser.add_argument('--compare', type=str,
+                          help='Earlier results file to compare against')
+        parser.add_argument('--skip-memory', action='store_true',
+                          help='Do not run each benchmark a second time to measure peak memory')
+
+    def handle(self, *args, **options):
+        previous = {}
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = {
+                        (row['benchmark'], row['rows']): row for row in json.load(f)['results']
+                    }
+            except (OSError, ValueError, KeyError) as e:
+                self.stdout.write(self.style.ERROR(f'Cannot read {options["compare"]}: {e}'))
+                return
+
+        self.stdout.write(
+            f'{"Benchmark":<22} {"Rows":>7} {"Seconds":>9} {"Rows/s":>10} {"Queries":>8} {"Peak KB":>9}'
+        )
+
+        def report(row):
+            line = (
+                f'{row["benchmark"]:<22} {row["rows"]:>7} {row["seconds"]:>9} '
+                f'{row["rows_per_second"]:>10} {row["queries"]:>8} {row["peak_memory_kb"] or "-":>9}'
+            )
+            before = previous.get((row['benchmark'], row['rows']))
+            if before and row['seconds']:
+                line += f'  {before["seconds"] / row["seconds"]:.2f}x vs previous'
+            self.stdout.write(line)
+
+        # The database user needs the same rights as for running the tests
+        with throwaway_database():
+            results = benchmark_pipeline(
+                options['sizes'], options['only'], memory=not options['skip_memory'], progress=report
+            )
+        results['label'] = options['label']
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
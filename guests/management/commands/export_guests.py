@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from guests.models import Event
+from guests.exporting import EXPORT_FORMATS, export_roster
+from guests.importing import guess_format
+import time
+
+class Command(BaseCommand):
+    help = 'Export the guest roster, or an event\'s invitations, to a CSV, XLSX or Parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_file', type=str, help='Path of the file to write')
+        parser.add_argument('--event-id', type=int, help='Export the invitations of this event')
+        parser.add_argument('--format', choices=EXPORT_FORMATS,
+                          help='File format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                          help='Rows read from the database at a time (and rows per Parquet row group)')
+
+    def handle(self, *args, **options):
+        output_path = options['output_file']
+        file_format = options['format'] or guess_format(output_path)
+        event_id = options.get('event_id')
+
+        event = None
+        if event_id:
+            try:
+                event = Event.objects.get(id=event_id)
+            except Event.DoesNotExist:
+                self.stdout.write(
+                    self.style.ERROR(f'Event with ID {event_id} does not exist')
+                )
+                return
+
+        started = time.monotonic()
+        try:
+            count = export_roster(
+                output_path, event=event, file_format=file_format, chunk_size=max(1, options['chunk_size'])
+            )
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error writing {file_format.upper()} file: {str(e)}')
+            )
+            return
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Exported {count} rows to {output_path} in {elapsed:.1f}s'
+            )
+        )
@@ -0,0 +1,44 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from guests.media import CODE_IMAGE_DIRS, collect_orphans
+from datetime import timedelta
+import time
+
+class Command(BaseCommand):
+    help = 'Delete media files (QR codes and barcodes by default) that no database row refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directories', nargs='*', default=list(CODE_IMAGE_DIRS),
+                          help='Storage directories to scan (default: qr_codes barcodes)')
+        parser.add_argument('--dry-run', action='store_true',
+                          help='Only report orphaned files, do not delete them')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                          help='Files checked against the database and deleted per batch')
+        parser.add_argument('--min-age', type=float, default=1,
+                          help='Keep files modified less than this many hours ago')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.stdout.write(f'Scanning {", ".join(options["directories"])} for orphaned files...')
+
+        result = collect_orphans(
+            default_storage,
+            directories=options['directories'],
+            batch_size=max(1, options['batch_size']),
+            min_age=timedelta(hours=options['min_age']),
+            dry_run=options['dry_run'],
+        )
+
+        elapsed = time.monotonic() - started
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING(f'Dry run: {result.found} orphaned file(s) would be deleted ({elapsed:.1f}s)')
+            )
+            return
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {result.deleted} orphaned file(s) in {elapsed:.1f}s')
+        )
+        if result.failed:
+            for name in result.failed:
+                self.stderr.write(self.style.ERROR(f'Could not delete {name}'))
+            raise CommandError(f'{len(result.failed)} of {result.found} orphaned file(s) could not be deleted')
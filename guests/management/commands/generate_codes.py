@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from guests.models import Event
+from guests.codes import default_worker_count, generate_event_codes
+import time
+
+class Command(BaseCommand):
+    help = 'Pre-render QR codes and barcodes for all invitations of an event into the code image cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int, help='Event ID to generate codes for')
+        parser.add_argument('--workers', type=int, default=default_worker_count(),
+                          help='Number of worker processes (default: number of CPU cores)')
+        parser.add_argument('--force', action='store_true',
+                          help='Re-render codes even if the images already exist')
+        parser.add_argument('--store', action='store_true',
+                          help='Save the images to media storage instead of the code image cache')
+        parser.add_argument('--format', choices=['png', 'svg'],
+                          help='Image format (default: INVITATION_CODE_FORMAT setting)')
+        parser.add_argument('--progress-every', type=int, default=100,
+                          help='Report progress every N invitations')
+
+    def handle(self, *args, **options):
+        event_id = options['event_id']
+        progress_every = max(1, options['progress_every'])
+
+        try:
+            event = Event.objects.get(id=event_id)
+        except Event.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'Event with ID {event_id} does not exist')
+            )
+            return
+
+        started = time.monotonic()
+
+        def progress(done, total):
+            if done % progress_every == 0 or done == total:
+                elapsed = time.monotonic() - started
+                rate = done / elapsed if elapsed else 0
+                self.stdout.write(f'{done}/{total} invitations processed ({rate:.1f}/s)')
+
+        self.stdout.write(
+            f'Generating codes for event: {event.name} using {options["workers"]} worker(s)'
+        )
+        result = generate_event_codes(
+            event,
+            workers=options['workers'],
+            force=options['force'],
+            store=options['store'],
+            fmt=options['format'],
+            progress=progress,
+        )
+
+        if not result.total:
+            self.stdout.write(self.style.WARNING('No invitations need codes'))
+            return
+
+        for pk, error in result.errors:
+            self.stdout.write(self.style.ERROR(f'✗ Invitation {pk}: {error}'))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\nCode generation complete in {time.monotonic() - started:.1f}s:\n'
+                f'- Rendered: {result.rendered}\n'
+                f'- Already rendered: {result.skipped}\n'
+                f'- Errors: {result.failed}'
+            )
+        )
@@ -1,20 +1,37 @@
+import os
+
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from guests.models import Event, Guest, Invitation, RSVP
-import csv
-from django.utils import timezone
+from guests.models import Event
+from guests.fast_import import fast_import_guest_rows
+from guests.importing import IMPORT_FORMATS, guess_format, import_guest_rows, read_rows
 
 class Command(BaseCommand):
-    help = 'Import guests from CSV file'
+    help = 'Import guests from a CSV, XLSX or Parquet file'
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_file', type=str, help='Path to CSV file')
+        parser.add_argument('input_file', type=str, help='Path to CSV, XLSX or Parquet file')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                          help='File format (default: from the file extension)')
         parser.add_argument('--event-id', type=int, help='Event ID to create invitations for')
         parser.add_argument('--create-invitations', action='store_true', 
                           help='Create invitations for the specified event')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                          help='Rows read and checked against existing guests at a time')
+        parser.add_argument('--batch-size', type=int, default=500,
+                          help='Rows per INSERT statement')
+        parser.add_argument('--progress-every', type=int, default=10000,
+                          help='Print a progress line every this many rows')
+        parser.add_argument('--fast', action='store_true',
+                          help='Load rows into a staging table with the database\'s bulk loader '
+                               '(COPY on PostgreSQL, LOAD DATA on MySQL) and upsert from there')
+        parser.add_argument('--validate', action='store_true',
+                          help='Normalize and validate rows with pandas first; only clean rows are imported')
+        parser.add_argument('--rejects', type=str,
+                          help='CSV file for rows rejected by --validate (default: <input_file>.rejects.csv)')
 
     def handle(self, *args, **options):
-        csv_file_path = options['csv_file']
+        input_path = options['input_file']
+        file_format = options['format'] or guess_format(input_path)
         event_id = options.get('event_id')
         create_invitations = options.get('create_invitations')
 
@@ -34,50 +51,72 @@ class Command(BaseCommand):
                 )
                 return
 
-        try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                guests_created = 0
-                invitations_created = 0
-
-                for row in reader:
-                    # Expected CSV columns: first_name, last_name, email, phone, address
-                    guest, created = Guest.objects.get_or_create(
-                        first_name=row.get('first_name', '').strip(),
-                        last_name=row.get('last_name', '').strip(),
-                        email=row.get('email', '').strip(),
-                        defaults={
-                            'phone': row.get('phone', '').strip(),
-                            'address': row.get('address', '').strip(),
-                        }
-                    )
+        progress_every = max(1, options['progress_every'])
+        reported = [0]
 
-                    if created:
-                        guests_created += 1
-                        self.stdout.write(f'Created guest: {guest.full_name}')
+        def report(result):
+            if result.rows - reported[0] >= progress_every:
+                reported[0] = result.rows
+                if options['fast']:
+                    self.stdout.write(f'{result.rows} rows staged ({result.rows_per_second:.0f} rows/s)')
+                    return
+                self.stdout.write(
+                    f'{result.rows} rows: {result.guests_created} guests created, '
+                    f'{result.invitations_created} invitations ({result.rows_per_second:.0f} rows/s)'
+                )
 
-                    # Create invitation if requested
-                    if create_invitations and event:
-                        invitation, inv_created = Invitation.objects.get_or_create(
-                            event=event,
-                            guest=guest
-                        )
-                        if inv_created:
-                            invitations_created += 1
+        validation = None
+        try:
+            if not os.path.isfile(input_path):
+                raise FileNotFoundError(input_path)
+            if options['validate']:
+                from guests.validation import ValidationResult, file_chunks, validated_frames, validated_rows
+                validation = ValidationResult()
+                rejects_path = options['rejects'] or f'{os.path.splitext(input_path)[0]}.rejects.csv'
+                chunks = file_chunks(input_path, file_format, chunk_size=max(1, options['chunk_size']))
+                rows = validated_rows(validated_frames(chunks, rejects_path, result=validation))
+            else:
+                rows = read_rows(input_path, file_format)
+            if options['fast']:
+                result = fast_import_guest_rows(
+                    rows,
+                    event=event if create_invitations else None,
+                    batch_size=max(1, options['batch_size']),
+                    progress=report,
+                    progress_every=progress_every,
+                )
+            else:
+                result = import_guest_rows(
+                    rows,
+                    event=event if create_invitations else None,
+                    chunk_size=max(1, options['chunk_size']),
+                    batch_size=max(1, options['batch_size']),
+                    progress=report,
+                )
 
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully processed {file_format.upper()} file:\n'
+                    f'- Rows: {result.rows}\n'
+                    f'- Guests created: {result.guests_created}\n'
+                    f'- Existing guests: {result.guests_existing}\n'
+                    f'- Invitations created: {result.invitations_created}\n'
+                    f'- Rows per second: {result.rows_per_second:.0f}'
+                )
+            )
+            if validation is not None:
                 self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Successfully processed CSV file:\n'
-                        f'- Guests created: {guests_created}\n'
-                        f'- Invitations created: {invitations_created}'
-                    )
+                    f'Validation: {validation.valid} of {validation.rows} rows valid, '
+                    f'{validation.rejected} rejected (written to {rejects_path})'
                 )
+                for reason, count in validation.reasons.most_common():
+                    self.stdout.write(f'  - {reason}: {count}')
 
         except FileNotFoundError:
             self.stdout.write(
-                self.style.ERROR(f'CSV file not found: {csv_file_path}')
+                self.style.ERROR(f'File not found: {input_path}')
             )
         except Exception as e:
             self.stdout.write(
-                self.style.ERROR(f'Error processing CSV file: {str(e)}')
+                self.style.ERROR(f'Error processing {file_format.upper()} file: {str(e)}')
             )
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from guests.models import Event
+from guests.codes import default_worker_count
+from guests.tickets import DEFAULT_COLUMNS, DEFAULT_ROWS, stream_ticket_pdf
+import time
+
+class Command(BaseCommand):
+    help = 'Write a printable PDF of tickets (QR code, barcode, table and seat) for an event'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int, help='Event ID to print tickets for')
+        parser.add_argument('output', type=str, help='Path of the PDF file to write')
+        parser.add_argument('--workers', type=int, default=default_worker_count(),
+                          help='Number of worker processes (default: number of CPU cores)')
+        parser.add_argument('--columns', type=int, default=DEFAULT_COLUMNS,
+                          help='Tickets across each page')
+        parser.add_argument('--rows', type=int, default=DEFAULT_ROWS,
+                          help='Tickets down each page')
+
+    def handle(self, *args, **options):
+        event_id = options['event_id']
+
+        try:
+            event = Event.objects.get(id=event_id)
+        except Event.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'Event with ID {event_id} does not exist')
+            )
+            return
+
+        if options['columns'] < 1 or options['rows'] < 1:
+            self.stdout.write(self.style.ERROR('--columns and --rows must be at least 1'))
+            return
+
+        started = time.monotonic()
+        size = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in stream_ticket_pdf(
+                event,
+                workers=options['workers'],
+                columns=options['columns'],
+                rows=options['rows'],
+            ):
+                output.write(chunk)
+                size += len(chunk)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Tickets for {event.name} written to {options["output"]} '
+                f'({size // 1024} KB in {time.monotonic() - started:.1f}s)'
+            )
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from guests.bounces import process_bounces
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Suppress guests whose email bounced, reading DSN bounce messages from an mbox file or Maildir'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mailbox', help='Path to an mbox file or a Maildir directory')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                          help='Bounced guests marked per batch of database updates')
+        parser.add_argument('--dry-run', action='store_true',
+                          help='Only report bounced addresses, do not change anything')
+
+    def handle(self, *args, **options):
+        mailbox = options['mailbox']
+        if not os.path.exists(mailbox):
+            self.stdout.write(self.style.ERROR(f'Mailbox {mailbox} does not exist'))
+            return
+
+        started = time.monotonic()
+        result = process_bounces(mailbox, batch_size=max(1, options['batch_size']), dry_run=options['dry_run'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(
+            f'Read {result.messages} message(s) in {elapsed:.1f}s: {result.bounces} bounced address(es), '
+            f'{result.unmatched} not matching any guest'
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run: {result.guests} guest(s) would be suppressed'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Suppressed {result.guests} guest(s); {result.invitations} invitation(s) marked as bounced'
+                )
+            )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from guests.emails import process_queued_send_jobs, process_send_job
+import time
+
+class Command(BaseCommand):
+    help = 'Send queued invitation emails (use when no Celery broker is configured)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job-id', type=int, help='Only run this send job')
+        parser.add_argument('--loop', action='store_true',
+                          help='Keep polling for new jobs instead of exiting')
+        parser.add_argument('--interval', type=float, default=5,
+                          help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        if options['job_id']:
+            outcome = process_send_job(options['job_id'])
+            if outcome is None:
+                self.stdout.write(
+                    self.style.WARNING(f'Send job {options["job_id"]} is not queued')
+                )
+                return
+            sent, failed = outcome
+            self.stdout.write(self.style.SUCCESS(f'Send job {options["job_id"]}: {sent} sent, {failed} failed'))
+            return
+
+        while True:
+            processed = process_queued_send_jobs()
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f'Processed {processed} send job(s)'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
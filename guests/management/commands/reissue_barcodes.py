@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from guests.models import Event, Invitation
+
+class Command(BaseCommand):
+    help = ('Move invitations from legacy MD5-derived barcode numbers to primary-key barcodes. '
+            'Reissued barcodes must be reprinted; the old numbers stop scanning.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-id', type=int, help='Only reissue barcodes for this event')
+        parser.add_argument('--dry-run', action='store_true',
+                          help='Show how many invitations would be reissued')
+
+    def handle(self, *args, **options):
+        event_id = options.get('event_id')
+
+        invitations = Invitation.objects.filter(barcode_number__isnull=False)
+        if event_id:
+            if not Event.objects.filter(id=event_id).exists():
+                self.stdout.write(
+                    self.style.ERROR(f'Event with ID {event_id} does not exist')
+                )
+                return
+            invitations = invitations.filter(event_id=event_id)
+
+        if options.get('dry_run'):
+            self.stdout.write(f'Would reissue {invitations.count()} legacy barcode(s)')
+            return
+
+        count = invitations.update(barcode_number=None, barcode_image='')
+        self.stdout.write(self.style.SUCCESS(f'Reissued {count} barcode(s)'))
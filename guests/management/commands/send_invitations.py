@@ -1,20 +1,80 @@
+import time
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from guests.models import Event, Invitation
-from guests.views import send_invitation_email
-from django.utils import timezone
+from guests.models import EmailTemplate, Event, SendJob
+from guests.emails import (
+    STATUS_CHUNK_SIZE, cancel_send_job, claim_send_job, pause_send_job,
+    queue_invitation_emails, run_send_job,
+)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
 
 class Command(BaseCommand):
-    help = 'Send email invitations for an event'
+    help = 'Send email invitations for an event, or resume, pause or cancel a send job'
 
     def add_arguments(self, parser):
-        parser.add_argument('event_id', type=int, help='Event ID to send invitations for')
-        parser.add_argument('--unsent-only', action='store_true', 
+        parser.add_argument('event_id', type=int, nargs='?', help='Event ID to send invitations for')
+        parser.add_argument('--unsent-only', action='store_true',
                           help='Only send to guests who haven\'t received invitations yet')
         parser.add_argument('--dry-run', action='store_true',
                           help='Show what would be sent without actually sending')
+        parser.add_argument('--chunk-size', type=int, default=STATUS_CHUNK_SIZE,
+                          help='Invitations loaded and checkpointed at a time')
+        parser.add_argument('--base-url', default='',
+                          help='Site URL for links in the emails, e.g. https://events.example.com')
+        parser.add_argument('--include-qr-code', action='store_true', default=None,
+                          help='Embed each guest\'s QR code in the email (default: EMAIL_INCLUDE_QR_CODE)')
+        parser.add_argument('--template', type=int, metavar='TEMPLATE_ID',
+                          help='EmailTemplate to use (default: the organizer\'s default invitation template)')
+        parser.add_argument('--resume', type=int, metavar='JOB_ID',
+                          help='Continue a paused, failed or interrupted send job from its checkpoint')
+        parser.add_argument('--force', action='store_true',
+                          help='With --resume, take over a running job even if it checkpointed recently')
+        parser.add_argument('--pause', type=int, metavar='JOB_ID',
+                          help='Pause a running send job after its current chunk')
+        parser.add_argument('--cancel', type=int, metavar='JOB_ID',
+                          help='Cancel a send job; unsent invitations are released')
 
     def handle(self, *args, **options):
+        if options['pause']:
+            return self.control(options['pause'], pause_send_job, 'paused')
+        if options['cancel']:
+            return self.control(options['cancel'], cancel_send_job, 'cancelled')
+        if options['resume']:
+            # A run killed without a chance to pause stays running; take it over
+            # once its heartbeat is stale, or at once with --force
+            statuses = ('queued', 'paused', 'failed')
+            if options['force']:
+                job = claim_send_job(options['resume'], statuses=statuses + ('running',))
+            else:
+                job = claim_send_job(options['resume'], statuses=statuses, stale_after=settings.SEND_JOB_STALE_AFTER)
+            if job is None:
+                if SendJob.objects.filter(pk=options['resume'], status='running').exists():
+                    self.stdout.write(self.style.ERROR(
+                        f'Send job {options["resume"]} is still running; '
+                        f'use --force if its run was killed'
+                    ))
+                else:
+                    self.stdout.write(
+                        self.style.ERROR(f'Send job {options["resume"]} does not exist or cannot be resumed')
+                    )
+                return
+            self.stdout.write(
+                f'Resuming send job {job.pk} for event: {job.event.name} '
+                f'({job.processed}/{job.total} already processed)'
+            )
+            return self.run(job, options['chunk_size'])
+
         event_id = options['event_id']
+        if event_id is None:
+            self.stdout.write(self.style.ERROR('Give an event ID, or one of --resume, --pause, --cancel'))
+            return
         unsent_only = options.get('unsent_only', False)
         dry_run = options.get('dry_run', False)
 
@@ -26,51 +86,88 @@ class Command(BaseCommand):
             )
             return
 
-        # Get invitations to send
+        template = None
+        if options['template']:
+            try:
+                template = EmailTemplate.objects.get(id=options['template'], template_type='invitation')
+            except EmailTemplate.DoesNotExist:
+                self.stdout.write(
+                    self.style.ERROR(f'Invitation email template with ID {options["template"]} does not exist')
+                )
+                return
+
         invitations = event.invitations.all()
         if unsent_only:
             invitations = invitations.filter(email_sent=False)
 
-        if not invitations.exists():
+        if dry_run:
             self.stdout.write(
-                self.style.WARNING('No invitations to send')
+                f'Found {invitations.count()} invitations to send for event: {event.name}'
             )
+            self.stdout.write(self.style.WARNING('DRY RUN - No emails will be sent'))
+            emails = invitations.order_by('pk').values_list('guest__email', flat=True)
+            for email in emails.iterator(chunk_size=options['chunk_size']):
+                self.stdout.write(f'Would send to: {email}')
             return
 
+        job = queue_invitation_emails(
+            event, invitations, base_url=options['base_url'], dispatch=False,
+            include_qr_code=options['include_qr_code'], template=template,
+        )
+        if job is None:
+            self.stdout.write(
+                self.style.WARNING('No invitations to send')
+            )
+            return
+        job = claim_send_job(job.pk)
         self.stdout.write(
-            f'Found {invitations.count()} invitations to send for event: {event.name}'
+            f'Sending {job.total} invitations for event: {event.name} as send job {job.pk}'
         )
+        self.run(job, options['chunk_size'])
 
-        if dry_run:
-            self.stdout.write(self.style.WARNING('DRY RUN - No emails will be sent'))
-            for invitation in invitations:
-                self.stdout.write(f'Would send to: {invitation.guest.email}')
-            return
+    def control(self, job_id, action, done):
+        if not SendJob.objects.filter(pk=job_id).exists():
+            self.stdout.write(self.style.ERROR(f'Send job {job_id} does not exist'))
+        elif action(job_id):
+            self.stdout.write(self.style.SUCCESS(f'Send job {job_id} {done}'))
+        else:
+            status = SendJob.objects.get(pk=job_id).get_status_display().lower()
+            self.stdout.write(self.style.WARNING(f'Send job {job_id} is {status}; nothing to do'))
 
-        sent_count = 0
-        error_count = 0
+    def run(self, job, chunk_size):
+        started = time.monotonic()
+        processed_at_start = job.processed
 
-        for invitation in invitations:
-            try:
-                if not invitation.email_sent or not unsent_only:
-                    send_invitation_email(invitation)
-                    invitation.email_sent = True
-                    invitation.email_sent_at = timezone.now()
-                    invitation.save()
-                    sent_count += 1
-                    self.stdout.write(f'✓ Sent to: {invitation.guest.email}')
-                else:
-                    self.stdout.write(f'- Skipped (already sent): {invitation.guest.email}')
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(
-                    self.style.ERROR(f'✗ Failed to send to {invitation.guest.email}: {str(e)}')
-                )
+        def report(job):
+            elapsed = time.monotonic() - started
+            rate = (job.processed - processed_at_start) / elapsed if elapsed else 0
+            remaining = job.total - job.processed
+            eta = format_duration(remaining / rate) if rate else '?'
+            self.stdout.write(
+                f'{job.processed}/{job.total} processed ({job.failed_count} failed), '
+                f'{rate:.1f}/s, ETA {eta}'
+            )
 
+        try:
+            sent_count, error_count = run_send_job(job, chunk_size, progress=report)
+        except KeyboardInterrupt:
+            # Whatever was sent before the last checkpoint is not sent again
+            pause_send_job(job.pk)
+            self.stdout.write(
+                self.style.WARNING(f'\nInterrupted; resume with --resume {job.pk}')
+            )
+            return
+
+        if job.status != 'completed':
+            self.stdout.write(
+                self.style.WARNING(f'Send job {job.pk} was {job.status} at {job.processed}/{job.total}')
+            )
+            return
         self.stdout.write(
             self.style.SUCCESS(
                 f'\nInvitation sending complete:\n'
                 f'- Successfully sent: {sent_count}\n'
-                f'- Errors: {error_count}'
+                f'- Errors: {error_count}\n'
+                f'- Time: {format_duration(time.monotonic() - started)}'
             )
         )
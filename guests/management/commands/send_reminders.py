@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from guests.emails import process_send_job
+from guests.models import Event
+from guests.reminders import schedule_reminders
+
+class Command(BaseCommand):
+    help = 'Send RSVP reminders that have come due (run periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, metavar='EVENT_ID',
+                          help='Only remind guests of this event')
+        parser.add_argument('--dry-run', action='store_true',
+                          help='Show how many reminders are due without sending them')
+        parser.add_argument('--queue-only', action='store_true',
+                          help='Queue the reminders for process_send_jobs instead of sending them now')
+
+    def handle(self, *args, **options):
+        events = None
+        if options['event']:
+            events = Event.objects.filter(id=options['event'])
+            if not events.exists():
+                self.stdout.write(
+                    self.style.ERROR(f'Event with ID {options["event"]} does not exist')
+                )
+                return
+
+        # With a broker, Celery workers pick the jobs up; otherwise they are
+        # sent here unless --queue-only
+        send_now = not options['queue_only'] and not settings.CELERY_BROKER_URL
+        results = schedule_reminders(events=events, dispatch=not send_now, dry_run=options['dry_run'])
+        if not results:
+            self.stdout.write('No reminders due')
+            return
+
+        for event, count, job in results:
+            if options['dry_run']:
+                self.stdout.write(f'{event.name}: {count} reminder(s) due')
+            elif send_now:
+                sent, failed = process_send_job(job.pk) or (0, 0)
+                self.stdout.write(
+                    self.style.SUCCESS(f'{event.name}: {sent} reminder(s) sent, {failed} failed')
+                )
+            else:
+                self.stdout.write(
+                    self.style.SUCCESS(f'{event.name}: {count} reminder(s) queued as send job {job.pk}')
+                )
@@ -0,0 +1,154 @@
+"""
+Media file layout and cleanup for invitation code images.
+
+New code images are spread over hash-prefix subdirectories
+(``qr_codes/3f/a2/qr_<code>.png``) so no single directory grows to hundreds
+of thousands of entries. Files left behind by deleted invitations are found
+by walking the storage and checking the names against the database in
+batches; this only uses the Storage API, so it works the same for the local
+file system and S3.
+"""
+import hashlib
+import logging
+import posixpath
+from dataclasses import dataclass, field
+from datetime import timedelta
+from itertools import islice
+
+from django.apps import apps
+from django.db import models
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Directories holding code images, sharded and unsharded (legacy) alike.
+CODE_IMAGE_DIRS = ('qr_codes', 'barcodes')
+
+
+def sharded_path(directory, filename):
+    """Place a file in two levels of hash-prefix subdirectories"""
+    digest = hashlib.md5(filename.encode()).hexdigest()
+    return posixpath.join(directory, digest[:2], digest[2:4], filename)
+
+
+def qr_code_upload_to(instance, filename):
+    return sharded_path('qr_codes', filename)
+
+
+def barcode_upload_to(instance, filename):
+    return sharded_path('barcodes', filename)
+
+
+def walk_storage(storage, directory):
+    """
+    Yield the name of every file under a storage directory.
+
+    Directories are listed one at a time, so memory use is bounded by the
+    largest single directory rather than the whole tree.
+    """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            dirs, files = storage.listdir(current)
+        except FileNotFoundError:
+            continue
+        for name in files:
+            yield posixpath.join(current, name)
+        stack.extend(posixpath.join(current, name) for name in reversed(dirs))
+
+
+def file_fields():
+    """(model, field name) for every FileField of every installed model"""
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField):
+                yield model, field.name
+
+
+def referenced_names(names, fields=None):
+    """Return the subset of ``names`` stored in any file field"""
+    referenced = set()
+    for model, field_name in fields or file_fields():
+        referenced.update(
+            model._default_manager.filter(**{f'{field_name}__in': names})
+            .values_list(field_name, flat=True)
+        )
+    return referenced
+
+
+def find_orphans(storage, directories=CODE_IMAGE_DIRS, batch_size=1000, min_age=None):
+    """
+    Yield files under ``directories`` that no database row refers to.
+
+    Names are checked against the database ``batch_size`` at a time. Files
+    modified less than ``min_age`` ago are skipped, so an upload whose row
+    has not been committed yet is not mistaken for an orphan.
+    """
+    fields = list(file_fields())
+    cutoff = timezone.now() - min_age if min_age else None
+    for directory in directories:
+        names = walk_storage(storage, directory)
+        while batch := list(islice(names, batch_size)):
+            referenced = referenced_names(batch, fields)
+            for name in batch:
+                if name in referenced:
+                    continue
+                if cutoff and storage.get_modified_time(name) > cutoff:
+                    continue
+                yield name
+
+
+def delete_files(storage, names):
+    """
+    Delete a batch of files, in one request per 1000 files on S3. Returns
+    the names S3 could not delete; other storages raise instead.
+    """
+    bucket = getattr(storage, 'bucket', None)
+    if bucket is None:
+        for name in names:
+            storage.delete(name)
+        return []
+
+    from storages.utils import clean_name, safe_join
+
+    failed = []
+    for start in range(0, len(names), 1000):
+        batch = names[start:start + 1000]
+        # Object keys are the names under the storage's location, as S3Storage builds them
+        keys = {safe_join(storage.location, clean_name(name)): name for name in batch}
+        response = bucket.delete_objects(Delete={'Objects': [{'Key': key} for key in keys]})
+        for error in response.get('Errors', []):
+            logger.error(f"Could not delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+            failed.append(keys.get(error['Key'], error['Key']))
+    return failed
+
+
+@dataclass
+class CollectResult:
+    found: int = 0
+    deleted: int = 0
+    # Names of the files the storage could not delete
+    failed: list = field(default_factory=list)
+
+
+def collect_orphans(storage, directories=CODE_IMAGE_DIRS, batch_size=1000,
+                    min_age=timedelta(hours=1), dry_run=False):
+    """
+    Remove orphaned files in batches; returns a CollectResult.
+
+    With ``dry_run`` the files are only counted (and logged).
+    """
+    result = CollectResult()
+    orphans = find_orphans(storage, directories, batch_size, min_age)
+    while batch := list(islice(orphans, batch_size)):
+        result.found += len(batch)
+        if dry_run:
+            for name in batch:
+                logger.info(f"Orphaned media file: {name}")
+            continue
+        failed = delete_files(storage, batch)
+        result.deleted += len(batch) - len(failed)
+        result.failed.extend(failed)
+        logger.info(f"Deleted {len(batch) - len(failed)} orphaned media file(s)")
+    return result
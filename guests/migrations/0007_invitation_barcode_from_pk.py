@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:45
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def blank_barcodes_to_null(apps, schema_editor):
+    # Existing barcode numbers stay valid as legacy codes. Rows without one
+    # switch to the primary-key based barcode, which is stored as NULL.
+    Invitation = apps.get_model('guests', 'Invitation')
+    Invitation.objects.filter(barcode_number='').update(barcode_number=None)
+
+
+def assign_legacy_barcodes(apps, schema_editor):
+    # The old scheme needs a stored, unique number on every row.
+    Invitation = apps.get_model('guests', 'Invitation')
+    for invitation in Invitation.objects.filter(barcode_number__isnull=True).iterator():
+        hash_str = hashlib.md5(str(invitation.unique_code).encode()).hexdigest()[:12]
+        invitation.barcode_number = ''.join([str(int(c, 16)) for c in hash_str])[:12]
+        invitation.save(update_fields=['barcode_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0006_guest_can_login_guest_last_login_guest_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invitation',
+            name='barcode_number',
+            field=models.CharField(blank=True, default=None, max_length=50, null=True, unique=True),
+        ),
+        migrations.RunPython(blank_barcodes_to_null, assign_legacy_barcodes),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:49
+
+import guests.media
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0007_invitation_barcode_from_pk'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invitation',
+            name='barcode_image',
+            field=models.ImageField(blank=True, null=True, upload_to=guests.media.barcode_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='invitation',
+            name='qr_code',
+            field=models.ImageField(blank=True, null=True, upload_to=guests.media.qr_code_upload_to),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0010_event_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='last_invitation_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sendjob',
+            name='processed_at_start',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='sendjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('paused', 'Paused'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('failed', 'Failed')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0011_send_job_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='include_qr_code',
+            field=models.BooleanField(default=False, help_text="Embed each guest's QR code in the email"),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0012_send_job_include_qr_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='email_type',
+            field=models.CharField(choices=[('invitation', 'Invitation'), ('reminder', 'Reminder'), ('confirmation', 'Confirmation'), ('update', 'Event Update'), ('thank_you', 'Thank You')], default='invitation', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='sendjob',
+            name='template',
+            field=models.ForeignKey(blank=True, help_text="Leave empty to use the organizer's default template of this type", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='send_jobs', to='guests.emailtemplate'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0013_send_job_email_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guest',
+            name='email_bounced_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invitation',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('queued', 'Queued'), ('sent', 'Sent'), ('failed', 'Failed'), ('bounced', 'Bounced'), ('opened', 'Opened'), ('responded', 'Responded')], default='draft', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0014_guest_email_bounced_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invitation',
+            name='last_reminder_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invitation',
+            name='reminder_count',
+            field=models.PositiveSmallIntegerField(default=0, help_text='RSVP reminders sent'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guests', '0015_invitation_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sendjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,15 +1,11 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
-from django.core.files import File
 import uuid
-import qrcode
-import barcode
-from barcode.writer import ImageWriter
-from io import BytesIO
-from PIL import Image
-import os
+from .codes import code_etag, code_payload, encode_barcode
+from .media import barcode_upload_to, qr_code_upload_to
 
 class EventCategory(models.Model):
     """Categories for events"""
@@ -47,6 +43,7 @@ class Event(models.Model):
     location = models.CharField(max_length=300)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     rsvp_deadline = models.DateTimeField(null=True, blank=True)
     max_guests = models.IntegerField(null=True, blank=True, help_text="Maximum number of guests allowed")
     
@@ -90,6 +87,9 @@ class Guest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     notes = models.TextField(blank=True, help_text="Internal notes about the guest")
     
+    # Set when mail to this address bounced; no more email is sent to it
+    email_bounced_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
     # Guest portal settings
     can_login = models.BooleanField(default=False, help_text="Allow this guest to login to the portal")
     last_login = models.DateTimeField(null=True, blank=True)
@@ -137,11 +137,40 @@ class Guest(models.Model):
         ordering = ['last_name', 'first_name']
         unique_together = ['first_name', 'last_name', 'email']
 
+class InvitationQuerySet(models.QuerySet):
+    def bulk_invite(self, event, guests, batch_size=500, already_invited=None):
+        """
+        Create invitations for many guests with batched INSERTs.
+
+        Guests already invited to the event are skipped. Unique codes are
+        assigned in memory and barcodes derive from the primary key; QR and
+        barcode images are rendered on demand, or ahead of time in a batch
+        with ``guests.codes.generate_missing_codes``. Callers inviting in
+        several rounds can pass (and keep) the set of ``already_invited``
+        guest ids so the event's invitations are only loaded once.
+        Returns the list of created invitations.
+        """
+        if already_invited is None:
+            already_invited = set(
+                self.filter(event=event).values_list('guest_id', flat=True)
+            )
+        invitations = []
+        for guest in guests:
+            guest_id = getattr(guest, 'pk', guest)
+            if guest_id in already_invited:
+                continue
+            already_invited.add(guest_id)
+            invitations.append(self.model(event=event, guest_id=guest_id))
+        return self.bulk_create(invitations, batch_size=batch_size)
+
 class Invitation(models.Model):
     """Model for invitations sent to guests"""
     STATUS_CHOICES = [
         ('draft', 'Draft'),
+        ('queued', 'Queued'),
         ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('bounced', 'Bounced'),
         ('opened', 'Opened'),
         ('responded', 'Responded'),
     ]
@@ -156,13 +185,20 @@ class Invitation(models.Model):
     email_sent = models.BooleanField(default=False)
     email_sent_at = models.DateTimeField(null=True, blank=True)
     opened_at = models.DateTimeField(null=True, blank=True)
+    reminder_count = models.PositiveSmallIntegerField(default=0, help_text="RSVP reminders sent")
+    last_reminder_at = models.DateTimeField(null=True, blank=True)
+    # Send job that last queued this invitation's email
+    send_job = models.ForeignKey('SendJob', on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='invitations')
     
-    # QR Code functionality
-    qr_code = models.ImageField(upload_to='qr_codes/', blank=True, null=True)
+    # Optional stored copies of the code images (generate_codes --store);
+    # pages and emails use the on-demand invitation_code_image view instead.
+    qr_code = models.ImageField(upload_to=qr_code_upload_to, blank=True, null=True)
     
     # Barcode functionality
-    barcode_image = models.ImageField(upload_to='barcodes/', blank=True, null=True)
-    barcode_number = models.CharField(max_length=50, blank=True, unique=True)
+    barcode_image = models.ImageField(upload_to=barcode_upload_to, blank=True, null=True)
+    # Legacy MD5-derived numbers only; newer invitations use encode_barcode(pk)
+    barcode_number = models.CharField(max_length=50, blank=True, null=True, default=None, unique=True)
     
     # Check-in tracking
     checked_in = models.BooleanField(default=False)
@@ -175,75 +211,11 @@ class Invitation(models.Model):
     # Personal message
     personal_message = models.TextField(blank=True, help_text="Personal message for this guest")
     
+    objects = InvitationQuerySet.as_manager()
+    
     def __str__(self):
         return f"Invitation to {self.guest} for {self.event}"
     
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if not self.qr_code:
-            self.generate_qr_code()
-        if not self.barcode_image:
-            self.generate_barcode()
-    
-    def generate_qr_code(self):
-        """Generate QR code for the invitation"""
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        
-        # Create the RSVP URL
-        rsvp_url = f"http://localhost:8000/rsvp/{self.unique_code}/"
-        qr.add_data(rsvp_url)
-        qr.make(fit=True)
-
-        # Create QR code image
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save to memory
-        buffer = BytesIO()
-        qr_image.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        # Save to model
-        filename = f'qr_{self.unique_code}.png'
-        self.qr_code.save(filename, File(buffer), save=False)
-        super().save(update_fields=['qr_code'])
-    
-    def generate_barcode(self):
-        """Generate barcode for the invitation"""
-        # Use the UUID as the barcode number (convert to numeric string)
-        if not self.barcode_number:
-            # Create a unique numeric ID based on the invitation ID and timestamp
-            import hashlib
-            hash_str = hashlib.md5(str(self.unique_code).encode()).hexdigest()[:12]
-            self.barcode_number = ''.join([str(int(c, 16)) for c in hash_str])[:12]
-        
-        # Generate Code128 barcode
-        try:
-            code128 = barcode.get_barcode_class('code128')
-            barcode_instance = code128(self.barcode_number, writer=ImageWriter())
-            
-            # Save to memory
-            buffer = BytesIO()
-            barcode_instance.write(buffer, options={
-                'module_width': 0.3,
-                'module_height': 10,
-                'quiet_zone': 2,
-                'font_size': 10,
-                'text_distance': 3,
-            })
-            buffer.seek(0)
-            
-            # Save to model
-            filename = f'barcode_{self.unique_code}.png'
-            self.barcode_image.save(filename, File(buffer), save=False)
-            super().save(update_fields=['barcode_image', 'barcode_number'])
-        except Exception as e:
-            print(f"Error generating barcode: {e}")
-    
     def check_in_guest(self):
         """Mark guest as checked in"""
         if not self.checked_in:
@@ -257,6 +229,33 @@ class Invitation(models.Model):
         """Generate the RSVP URL for this invitation"""
         return reverse('rsvp', kwargs={'code': str(self.unique_code)})
     
+    @property
+    def barcode(self):
+        """Value printed in the invitation's barcode"""
+        if self.barcode_number:
+            return self.barcode_number
+        return encode_barcode(self.pk) if self.pk else ''
+    
+    def get_code_url(self, kind, fmt=None):
+        """
+        URL of the on-demand code image, in INVITATION_CODE_FORMAT unless
+        ``fmt`` is given. The URL carries the image's ETag, so a reissued
+        barcode gets a new URL instead of a stale cached image.
+        """
+        fmt = fmt or settings.INVITATION_CODE_FORMAT
+        url = reverse('invitation_code_image', kwargs={
+            'code': str(self.unique_code),
+            'kind': kind,
+            'fmt': fmt,
+        })
+        return f'{url}?v={code_etag(kind, code_payload(kind, str(self.unique_code), self.barcode), fmt)}'
+    
+    def get_qr_code_url(self, fmt=None):
+        return self.get_code_url('qr', fmt)
+    
+    def get_barcode_url(self, fmt=None):
+        return self.get_code_url('barcode', fmt)
+    
     @property
     def is_responded(self):
         """Check if guest has responded"""
@@ -386,6 +385,82 @@ class EmailTemplate(models.Model):
     class Meta:
         ordering = ['template_type', 'name']
 
+class SendJob(models.Model):
+    """A batch of invitation emails sent in the background"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('paused', 'Paused'),
+        ('completed', 'Completed'),
+        ('cancelled', 'Cancelled'),
+        ('failed', 'Failed'),
+    ]
+    
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='send_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    include_qr_code = models.BooleanField(default=False, help_text="Embed each guest's QR code in the email")
+    email_type = models.CharField(max_length=20, choices=EmailTemplate.TEMPLATE_TYPES, default='invitation')
+    template = models.ForeignKey(
+        EmailTemplate, on_delete=models.SET_NULL, null=True, blank=True, related_name='send_jobs',
+        help_text="Leave empty to use the organizer's default template of this type"
+    )
+    # Checkpoint: invitations up to this primary key have been processed
+    last_invitation_id = models.PositiveBigIntegerField(default=0)
+    # Invitations already processed when the current run started (for the rate)
+    processed_at_start = models.PositiveIntegerField(default=0)
+    # Scheme and host for links in the emails, taken from the queuing request
+    base_url = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Set when a run claims the job and at every checkpoint
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Send job {self.pk} for {self.event} ({self.get_status_display()})"
+    
+    @property
+    def is_active(self):
+        return self.status in ('queued', 'running')
+    
+    @property
+    def processed(self):
+        return self.sent_count + self.failed_count
+    
+    def rate(self):
+        """Invitations processed per second in the current run"""
+        if self.status != 'running' or not self.started_at:
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        return (self.processed - self.processed_at_start) / elapsed if elapsed > 0 else None
+    
+    def eta_seconds(self):
+        rate = self.rate()
+        return round((self.total - self.processed) / rate) if rate else None
+    
+    def progress(self):
+        """Progress as of the last checkpoint"""
+        rate = self.rate()
+        return {
+            'id': self.pk,
+            'status': self.status,
+            'total': self.total,
+            'queued': self.total - self.processed,
+            'sent': self.sent_count,
+            'failed': self.failed_count,
+            'percent': round(self.processed * 100 / self.total) if self.total else 100,
+            'rate': round(rate, 2) if rate else None,
+            'eta_seconds': self.eta_seconds(),
+        }
+    
+    class Meta:
+        ordering = ['-created_at']
+
 class EventWaitlist(models.Model):
     """Waitlist for full events"""
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='waitlist')
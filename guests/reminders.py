@@ -0,0 +1,81 @@
+"""
+Scheduled RSVP reminders.
+
+Guests who have not answered an invitation get one reminder for each entry
+of RSVP_REMINDER_DAYS (days before the event's RSVP deadline) that has come
+due. An invitation's ``reminder_count`` records how many it has had, so every
+run only queues reminders that fell due since the last one, and running it
+often (e.g. every few minutes from cron) sends nothing twice. Reminders go
+out as 'reminder' send jobs, rendered from the organizer's reminder
+EmailTemplate.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .emails import queue_invitation_emails
+from .models import Event
+
+
+def reminder_schedule():
+    """Reminder offsets before the deadline, earliest reminder first"""
+    return sorted({days for days in settings.RSVP_REMINDER_DAYS if days >= 0}, reverse=True)
+
+
+def reminders_due(deadline, now, schedule=None):
+    """How many reminders have come due by ``now``, and when the last one did"""
+    schedule = reminder_schedule() if schedule is None else schedule
+    due_times = [deadline - timedelta(days=days) for days in schedule if deadline - timedelta(days=days) <= now]
+    return len(due_times), (due_times[-1] if due_times else None)
+
+
+def events_with_reminders_due(now, schedule=None):
+    """Events whose RSVP deadline is ahead and whose first reminder is due"""
+    schedule = reminder_schedule() if schedule is None else schedule
+    if not schedule:
+        return Event.objects.none()
+    return Event.objects.filter(rsvp_deadline__gt=now, rsvp_deadline__lte=now + timedelta(days=schedule[0]))
+
+
+def reminder_invitations(event, due, due_since):
+    """
+    Invitations of an event still owed a reminder: sent, not answered (an
+    anti-join on RSVP), fewer than ``due`` reminders so far and none since
+    the latest one came due at ``due_since``, and not already queued for an
+    email or in an unfinished reminder job. Guests who missed several
+    reminders get only one.
+    """
+    return event.invitations.filter(
+        Q(last_reminder_at__isnull=True) | Q(last_reminder_at__lt=due_since),
+        rsvp__isnull=True, email_sent=True, reminder_count__lt=due,
+    ).exclude(status='queued').exclude(
+        send_job__email_type='reminder', send_job__status__in=('queued', 'running', 'paused')
+    )
+
+
+def schedule_reminders(now=None, events=None, dispatch=True, dry_run=False):
+    """
+    Queue the reminders that are due; returns ``(event, count, job)`` for
+    every event with reminders due. With ``dry_run`` nothing is queued and
+    ``job`` is None.
+    """
+    now = now or timezone.now()
+    schedule = reminder_schedule()
+    events = events if events is not None else events_with_reminders_due(now, schedule)
+    results = []
+    for event in events:
+        if event.rsvp_deadline is None or event.rsvp_deadline <= now:
+            continue
+        due, due_since = reminders_due(event.rsvp_deadline, now, schedule)
+        if not due:
+            continue
+        invitations = reminder_invitations(event, due, due_since)
+        if dry_run:
+            results.append((event, invitations.count(), None))
+            continue
+        job = queue_invitation_emails(event, invitations, dispatch=dispatch, email_type='reminder')
+        if job is not None:
+            results.append((event, job.total, job))
+    return results
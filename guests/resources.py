@@ -0,0 +1,53 @@
+"""
+django-import-export resources for the admin's import and export buttons.
+
+Large rosters should go through the import_guests and export_guests
+commands, which stream their files.
+"""
+from import_export import fields, resources
+
+from .importing import IMPORT_FIELDS
+from .models import Guest, Invitation
+
+
+class GuestResource(resources.ModelResource):
+    """Guests keyed on their unique (first name, last name, email)"""
+
+    class Meta:
+        model = Guest
+        fields = IMPORT_FIELDS
+        import_id_fields = ('first_name', 'last_name', 'email')
+        skip_unchanged = True
+        report_skipped = False
+        use_bulk = True
+        batch_size = 500
+        chunk_size = 2000
+
+
+class InvitationResource(resources.ModelResource):
+    """
+    Invitations with their guest and RSVP; imports update seating and
+    personal messages of existing invitations, matched on their code.
+    """
+    event = fields.Field(attribute='event__name', column_name='event', readonly=True)
+    first_name = fields.Field(attribute='guest__first_name', column_name='first_name', readonly=True)
+    last_name = fields.Field(attribute='guest__last_name', column_name='last_name', readonly=True)
+    email = fields.Field(attribute='guest__email', column_name='email', readonly=True)
+    rsvp = fields.Field(attribute='rsvp__response', column_name='rsvp', readonly=True)
+    status = fields.Field(attribute='status', column_name='status', readonly=True)
+    checked_in = fields.Field(attribute='checked_in', column_name='checked_in', readonly=True)
+
+    class Meta:
+        model = Invitation
+        fields = (
+            'unique_code', 'event', 'first_name', 'last_name', 'email', 'status', 'rsvp',
+            'table_number', 'seat_number', 'personal_message', 'checked_in',
+        )
+        export_order = fields
+        import_id_fields = ('unique_code',)
+        skip_unchanged = True
+        report_skipped = False
+        chunk_size = 2000
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('event', 'guest', 'rsvp')
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from .emails import process_send_job
+
+
+@shared_task(ignore_result=True)
+def send_invitation_job(job_id):
+    """Send the emails of a queued SendJob"""
+    process_send_job(job_id)
@@ -1,9 +1,78 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import EventCategory, EventTemplate, Event, Guest, Invitation, RSVP
+from .models import EmailTemplate, EventAnalytics, EventCategory, EventTemplate, Event, Guest, Invitation, RSVP, SendJob
 from django.urls import reverse
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
 from django.utils import timezone
+from storages.backends.s3 import S3Storage
+from .codes import decode_barcode, encode_barcode, encoded_code_image, generate_event_codes
+from . import codes, tracking
+from .benchmarks import benchmark_pipeline
+from .bounces import process_bounces
+from .cache import SHARDS, ShardedFileCache
+from .email_rendering import (
+    compiled_email_template, email_templates, event_render, render_invitation_email, render_invitation_templates,
+)
+from .emails import (
+    build_invitation_message, cancel_send_job, claim_send_job, pause_send_job, process_queued_send_jobs,
+    queue_invitation_emails, run_send_job, send_invitation_batches,
+)
+from .exporting import export_roster, stream_guest_list
+from .importing import IMPORT_FIELDS
+from .mail_scheduler import MailScheduler, RateLimiter
+from .media import collect_orphans, delete_files
+from .resources import GuestResource
+from .tickets import stream_ticket_pdf
+import csv
 import datetime
+import io
+import os
+import smtplib
+from unittest import mock
+import tempfile
+import threading
+import time
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'codes': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-codes'},
+}
+
+# The manifest storage needs collectstatic; pages with {% static %} render without it
+TEST_STORAGES = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+class EventFixture:
+    """Create a user and an event with ``guest_count`` guests, invited unless ``invite`` is False"""
+    guest_count = 3
+    invite = True
+    login = False
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        if self.login:
+            self.client.force_login(self.user)
+        self.event = Event.objects.create(
+            name='Test Event',
+            date=timezone.now() + datetime.timedelta(days=10),
+            location='Test Location',
+            created_by=self.user
+        )
+        self.guests = [
+            Guest.objects.create(first_name=f'Guest{i}', last_name='Doe', email=f'g{i}@example.com')
+            for i in range(self.guest_count)
+        ]
+        if self.invite:
+            for guest in self.guests:
+                Invitation.objects.create(event=self.event, guest=guest)
 
 class ModelTests(TestCase):
     def setUp(self):
@@ -51,3 +120,738 @@ class HomeViewTests(TestCase):
         response = self.client.get(reverse('home'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Test Event')
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CACHES=TEST_CACHES)
+class CodeGenerationTests(EventFixture, TestCase):
+    def test_generate_event_codes_warms_cache(self):
+        progress = []
+        result = generate_event_codes(self.event, workers=2, progress=lambda done, total: progress.append(done))
+        self.assertEqual((result.total, result.rendered, result.failed), (3, 3, 0))
+        self.assertEqual(progress[-1], 3)
+        result = generate_event_codes(self.event)
+        self.assertEqual((result.rendered, result.skipped), (0, 3))
+
+    def test_generate_event_codes_store(self):
+        result = generate_event_codes(self.event, workers=1, store=True)
+        self.assertEqual(result.rendered, 3)
+        for invitation in self.event.invitations.all():
+            self.assertTrue(invitation.qr_code)
+            self.assertTrue(invitation.barcode_image)
+        self.assertEqual(generate_event_codes(self.event, store=True).total, 0)
+
+class InvitationSaveTests(EventFixture, TestCase):
+    guest_count = 1
+    invite = False
+
+    def setUp(self):
+        super().setUp()
+        self.guest = self.guests[0]
+
+    def test_create_invitation_is_single_query(self):
+        with self.assertNumQueries(1):
+            invitation = Invitation.objects.create(event=self.event, guest=self.guest)
+        invitation.refresh_from_db()
+        self.assertFalse(invitation.qr_code)
+        self.assertEqual(decode_barcode(invitation.barcode), invitation.pk)
+
+    def test_check_in_is_single_query(self):
+        invitation = Invitation.objects.create(event=self.event, guest=self.guest)
+        with self.assertNumQueries(1):
+            self.assertTrue(invitation.check_in_guest())
+
+class BulkInviteTests(EventFixture, TestCase):
+    guest_count = 5
+    invite = False
+
+    def test_bulk_invite_skips_invited_guests(self):
+        Invitation.objects.bulk_invite(self.event, self.guests[:2])
+        # One lookup of invited guests plus two batched INSERTs
+        with self.assertNumQueries(3):
+            created = Invitation.objects.bulk_invite(self.event, self.guests, batch_size=2)
+        self.assertEqual(len(created), 3)
+        self.assertEqual(self.event.invitations.count(), 5)
+        barcodes = {invitation.barcode for invitation in self.event.invitations.all()}
+        self.assertEqual(len(barcodes), 5)
+        self.assertFalse(self.event.invitations.exclude(qr_code='').exists())
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CACHES=TEST_CACHES)
+class CodeImageTests(EventFixture, TestCase):
+    def test_code_image_view(self):
+        invitation = self.event.invitations.first()
+        for url in (invitation.get_qr_code_url(), invitation.get_barcode_url()):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertIn('max-age=', response['Cache-Control'])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(url.split('?')[0])
+            self.assertIn('no-cache', response['Cache-Control'])
+        response = self.client.get(invitation.get_barcode_url('svg'))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'viewBox', response.content)
+        response = self.client.get(f'/codes/{invitation.unique_code}/logo.png')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/codes/{invitation.unique_code}/qr.gif')
+        self.assertEqual(response.status_code, 404)
+
+    def test_sharded_file_cache_culls_least_recently_used(self):
+        cache = ShardedFileCache(tempfile.mkdtemp(), {'OPTIONS': {'MAX_ENTRIES': SHARDS * 2, 'CULL_FREQUENCY': 2}})
+        shards = {}
+        for i in range(2000):
+            shards.setdefault(os.path.dirname(cache._key_to_file(f'key{i}')), []).append(f'key{i}')
+        first, second, third = next(keys for keys in shards.values() if len(keys) >= 3)[:3]
+        cache.set(first, b'1')
+        cache.set(second, b'2')
+        os.utime(cache._key_to_file(first), (100, 100))
+        os.utime(cache._key_to_file(second), (200, 200))
+        self.assertEqual(cache.get(first), b'1')  # now the most recently used
+        cache.set(third, b'3')
+        self.assertIsNone(cache.get(second))
+        self.assertEqual((cache.get(first), cache.get(third)), (b'1', b'3'))
+
+class BarcodeTests(EventFixture, TestCase):
+    guest_count = 1
+    login = True
+
+    def setUp(self):
+        super().setUp()
+        self.invitation = self.event.invitations.get()
+
+    def test_encode_decode_round_trip(self):
+        self.assertEqual(decode_barcode(encode_barcode(42)), 42)
+        self.assertEqual(decode_barcode(encode_barcode(123456789)), 123456789)
+
+    def test_decode_rejects_typos(self):
+        value = encode_barcode(42)
+        typo = value[:-1] + str((int(value[-1]) + 1) % 10)
+        self.assertIsNone(decode_barcode(typo))
+        self.assertIsNone(decode_barcode('12ab'))
+
+    def test_secret_rotation(self):
+        value = encode_barcode(42)
+        with override_settings(SECRET_KEY='rotated-secret-key'):
+            self.assertEqual(encode_barcode(42), value)
+        with override_settings(BARCODE_SECRET='new-barcode-secret'):
+            self.assertNotEqual(encode_barcode(42), value)
+            self.assertIsNone(decode_barcode(value))
+        with override_settings(BARCODE_SECRET='new-barcode-secret', BARCODE_SECRET_FALLBACKS=[settings.BARCODE_SECRET]):
+            self.assertEqual(decode_barcode(value), 42)
+            self.assertEqual(decode_barcode(encode_barcode(42)), 42)
+
+    def test_scan_resolves_by_primary_key(self):
+        response = self.client.post(reverse('scan_barcode'), {'barcode_number': self.invitation.barcode})
+        self.assertEqual(response.context['invitation'], self.invitation)
+
+    def test_scan_rejects_invalid_barcode_without_lookup(self):
+        value = encode_barcode(self.invitation.pk)
+        with self.assertNumQueries(2):  # session, user
+            response = self.client.post(reverse('scan_barcode'), {'barcode_number': value[:-1] + 'x'})
+        self.assertIsNone(response.context['invitation'])
+
+    def test_scan_legacy_barcode(self):
+        Invitation.objects.filter(pk=self.invitation.pk).update(barcode_number='123456789012')
+        response = self.client.post(reverse('scan_barcode'), {'barcode_number': '123456789012'})
+        self.assertEqual(response.context['invitation'], self.invitation)
+
+    @override_settings(STORAGES=TEST_STORAGES)
+    def test_admin_barcode_search_keeps_list_filters(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        other = Event.objects.create(name='Other Event', date=self.event.date, location='Elsewhere', created_by=self.user)
+        url = reverse('admin:guests_invitation_changelist')
+        barcode = self.invitation.barcode
+        response = self.client.get(url, {'q': barcode, 'event__id__exact': self.event.pk})
+        self.assertEqual(list(response.context['cl'].result_list), [self.invitation])
+        response = self.client.get(url, {'q': barcode, 'event__id__exact': other.pk})
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    def test_reissued_barcode_gets_new_image_url(self):
+        Invitation.objects.filter(pk=self.invitation.pk).update(barcode_number='123456789012')
+        legacy_url = Invitation.objects.get(pk=self.invitation.pk).get_barcode_url()
+        call_command('reissue_barcodes', stdout=io.StringIO())
+        url = Invitation.objects.get(pk=self.invitation.pk).get_barcode_url()
+        self.assertNotEqual(url, legacy_url)
+        self.assertIn('max-age=', self.client.get(url)['Cache-Control'])
+        self.assertIn('no-cache', self.client.get(legacy_url)['Cache-Control'])
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CACHES=TEST_CACHES)
+class TicketPdfTests(EventFixture, TestCase):
+    def test_ticket_pdf(self):
+        pdf = b''.join(stream_ticket_pdf(self.event, workers=2, columns=2, rows=1))
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+        self.assertIn(b'/Count 2', pdf)
+
+    @override_settings(TICKET_PDF_WORKERS=1)
+    def test_ticket_pdf_view(self):
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('event_tickets_pdf', args=[self.event.id]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.streaming)
+        self.assertIn(b'/Count 1', b''.join(response.streaming_content))
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CACHES=TEST_CACHES)
+class MediaCleanupTests(EventFixture, TestCase):
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_gc_media_removes_orphans(self):
+        generate_event_codes(self.event, workers=1, store=True)
+        stored = self.event.invitations.first().qr_code.name
+        self.assertRegex(stored, r'^qr_codes/[0-9a-f]{2}/[0-9a-f]{2}/qr_')
+        orphan = default_storage.save('qr_codes/ab/cd/qr_orphan.png', ContentFile(b'png'))
+        self.assertEqual(collect_orphans(default_storage, min_age=None, dry_run=True).found, 1)
+        self.assertTrue(default_storage.exists(orphan))
+        result = collect_orphans(default_storage, batch_size=2, min_age=None)
+        self.assertEqual((result.found, result.deleted, result.failed), (1, 1, []))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(stored))
+
+    def test_delete_files_on_s3_reports_errors(self):
+        storage = S3Storage(location='media', bucket_name='guests')
+        bucket = mock.Mock()
+        bucket.delete_objects.return_value = {
+            'Deleted': [{'Key': 'media/qr_codes/ab/cd/a.png'}],
+            'Errors': [{'Key': 'media/qr_codes/ab/cd/b.png', 'Code': 'AccessDenied', 'Message': 'Access Denied'}],
+        }
+        with mock.patch.object(S3Storage, 'bucket', bucket), self.assertLogs('guests.media', 'ERROR'):
+            failed = delete_files(storage, ['qr_codes/ab/cd/a.png', 'qr_codes/ab/cd/b.png'])
+        self.assertEqual(failed, ['qr_codes/ab/cd/b.png'])
+        bucket.delete_objects.assert_called_once_with(Delete={'Objects': [
+            {'Key': 'media/qr_codes/ab/cd/a.png'}, {'Key': 'media/qr_codes/ab/cd/b.png'},
+        ]})
+
+        # gc_media reports the rejected key and fails
+        orphans = ['qr_codes/ab/cd/a.png', 'qr_codes/ab/cd/b.png']
+        output, errors = io.StringIO(), io.StringIO()
+        with mock.patch.object(S3Storage, 'bucket', bucket), \
+                mock.patch('guests.media.find_orphans', return_value=iter(orphans)), \
+                mock.patch('guests.management.commands.gc_media.default_storage', storage), \
+                self.assertLogs('guests.media', 'ERROR'), \
+                self.assertRaisesMessage(CommandError, '1 of 2 orphaned file(s) could not be deleted'):
+            call_command('gc_media', stdout=output, stderr=errors)
+        self.assertIn('Deleted 1 orphaned file(s)', output.getvalue())
+        self.assertIn('Could not delete qr_codes/ab/cd/b.png', errors.getvalue())
+
+class BenchmarkTests(EventFixture, TestCase):
+    guest_count = 5
+    invite = False
+
+    def test_pipeline_benchmark_leaves_no_rows(self):
+        results = benchmark_pipeline(sizes=(4,), benchmarks=['invitation_save', 'bulk_invite'])
+        rows = {row['benchmark']: row for row in results['results']}
+        self.assertEqual(rows['invitation_save']['queries'], 4)
+        self.assertLess(rows['bulk_invite']['queries'], 4)
+        self.assertGreater(rows['bulk_invite']['peak_memory_kb'], 0)
+        self.assertEqual(Invitation.objects.count(), 0)
+        self.assertEqual(Guest.objects.count(), 5)
+
+class SendJobTests(EventFixture, TestCase):
+    login = True
+
+    def setUp(self):
+        super().setUp()
+        EventAnalytics.objects.create(event=self.event)
+
+    def test_bulk_resend_queues_without_sending(self):
+        response = self.client.post(reverse('bulk_resend_invitations', args=[self.event.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        job = SendJob.objects.get()
+        self.assertEqual((job.status, job.total), ('queued', 3))
+        self.assertEqual(self.event.invitations.filter(status='queued').count(), 3)
+
+        # Find, claim and load the job, look up the organizer's template, check
+        # the job's status, load its invitations, one UPDATE for the results and
+        # one for the event's sent count, checkpoint, finish
+        with self.assertNumQueries(10):
+            self.assertEqual(process_queued_send_jobs(), 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('http://testserver/t/', mail.outbox[0].body)
+        self.assertIn('open.gif', mail.outbox[0].alternatives[0][0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent_count), ('completed', 3))
+        self.assertEqual(EventAnalytics.objects.get(event=self.event).emails_sent, 3)
+        self.assertEqual(self.event.invitations.filter(status='sent', email_sent=True).count(), 3)
+
+        progress = self.client.get(reverse('send_job_progress', args=[job.id])).json()
+        self.assertEqual((progress['sent'], progress['queued'], progress['percent']), (3, 0, 100))
+
+    def test_failed_email_is_recorded(self):
+        self.client.post(reverse('bulk_resend_invitations', args=[self.event.id]))
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=[1, OSError('refused'), 1]):
+            process_queued_send_jobs()
+        job = SendJob.objects.get()
+        self.assertEqual((job.sent_count, job.failed_count), (2, 1))
+        self.assertEqual(self.event.invitations.filter(status='failed').count(), 1)
+        self.assertEqual(job.progress()['failed'], 1)
+
+    def test_paused_job_resumes_from_checkpoint(self):
+        job = queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False)
+        job = claim_send_job(job.pk)
+        # Pause from "another process" once the first chunk is checkpointed
+        run_send_job(job, chunk_size=2, progress=lambda job: pause_send_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent_count, len(mail.outbox)), ('paused', 2, 2))
+        self.assertEqual(job.last_invitation_id, self.event.invitations.order_by('pk')[1].pk)
+
+        output = io.StringIO()
+        call_command('send_invitations', resume=job.pk, chunk_size=2, stdout=output)
+        self.assertIn('2/3 already processed', output.getvalue())
+        self.assertIn('3/3 processed', output.getvalue())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.sent_count, len(mail.outbox)), ('completed', 3, 3))
+        self.assertEqual(self.event.invitations.filter(status='sent').count(), 3)
+
+    def test_resume_takes_over_running_job_only_when_stale(self):
+        job = queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False)
+        claim_send_job(job.pk)
+        output = io.StringIO()
+        call_command('send_invitations', resume=job.pk, stdout=output)
+        self.assertIn('is still running', output.getvalue())
+        self.assertEqual(len(mail.outbox), 0)
+
+        SendJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+        call_command('send_invitations', resume=job.pk, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, len(mail.outbox)), ('completed', 3))
+
+    def test_resume_force_takes_over_running_job(self):
+        job = queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False)
+        claim_send_job(job.pk)
+        call_command('send_invitations', resume=job.pk, force=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+
+    def test_unsupported_email_type_rejected_at_queue_time(self):
+        with self.assertRaisesMessage(ValueError, 'There is no thank_you email template'):
+            queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False, email_type='thank_you')
+        self.assertFalse(SendJob.objects.exists())
+        thank_you = EmailTemplate.objects.create(
+            name='Thanks', template_type='thank_you', subject='Thanks', html_content='Thanks',
+            text_content='Thanks', created_by=self.user, is_default=True,
+        )
+        job = queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False, email_type='thank_you')
+        self.assertEqual(job.total, 3)
+
+        output = io.StringIO()
+        call_command('send_invitations', self.event.pk, template=thank_you.pk, stdout=output)
+        self.assertIn(f'Invitation email template with ID {thank_you.pk} does not exist', output.getvalue())
+
+    def test_resend_to_bounced_guest_warns(self):
+        invitation = self.event.invitations.first()
+        Guest.objects.filter(pk=invitation.guest_id).update(email_bounced_at=timezone.now())
+        response = self.client.post(reverse('resend_invitation', args=[invitation.pk]), follow=True)
+        message, = response.context['messages']
+        self.assertEqual(message.level_tag, 'warning')
+        self.assertIn('has bounced', message.message)
+        self.assertFalse(SendJob.objects.exists())
+
+    def test_dashboard_labels_send_job_by_email_type(self):
+        self.event.invitations.update(status='sent', email_sent=True)
+        queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False, email_type='reminder')
+        response = self.client.get(reverse('event_dashboard', args=[self.event.pk]))
+        self.assertContains(response, 'Reminder emails:')
+
+    def test_cancel_releases_unsent_invitations(self):
+        self.event.invitations.filter(pk=self.event.invitations.first().pk).update(email_sent=True)
+        job = queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False)
+        self.assertTrue(cancel_send_job(job.pk))
+        self.assertFalse(cancel_send_job(job.pk))
+        self.assertIsNone(claim_send_job(job.pk))
+        self.assertEqual(
+            sorted(self.event.invitations.values_list('status', flat=True)), ['draft', 'draft', 'sent']
+        )
+
+class MailSchedulerTests(EventFixture, TestCase):
+    @override_settings(EMAIL_BATCH_SIZE=2, EMAIL_SEND_WORKERS=1)
+    def test_batches_reuse_one_connection(self):
+        invitations = self.event.invitations.select_related('guest', 'event')
+        with mock.patch.object(locmem.EmailBackend, 'open') as opened:
+            results = list(send_invitation_batches(invitations))
+        self.assertEqual(opened.call_count, 2)  # one SMTP session per batch of two
+        self.assertEqual([error for _, error in results], [None] * 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+
+    def test_batch_reconnects_after_disconnect(self):
+        invitations = self.event.invitations.select_related('guest', 'event')
+        send = locmem.EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise smtplib.SMTPServerDisconnected('gone')
+            return send(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', flaky):
+            results = list(send_invitation_batches(invitations))
+        self.assertEqual([error for _, error in results], [None] * 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_BACKOFF_SECONDS=0.01)
+    def test_temporary_rejection_is_retried(self):
+        invitations = self.event.invitations.select_related('guest', 'event')
+        send = locmem.EmailBackend.send_messages
+        calls = []
+
+        def throttled(backend, messages):
+            calls.append(messages)
+            if len(calls) == 1:
+                raise smtplib.SMTPDataError(421, b'Too many messages, slow down')
+            if messages[0].to == ['g2@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'g2@example.com': (550, b'No such user')})
+            return send(backend, messages)
+
+        scheduler = MailScheduler(workers=2)
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', throttled):
+            results = {inv.guest.email: error for inv, error in send_invitation_batches(invitations, scheduler=scheduler)}
+        self.assertIsNone(results['g0@example.com'])
+        self.assertIsNone(results['g1@example.com'])
+        self.assertIsInstance(results['g2@example.com'], smtplib.SMTPRecipientsRefused)
+        self.assertEqual((scheduler.stats.sent, scheduler.stats.failed, scheduler.stats.retries), (2, 1, 1))
+
+    def test_broken_connection_close_does_not_hang_send(self):
+        class BrokenConnection:
+            def open(self):
+                pass
+
+            def send_messages(self, messages):
+                raise smtplib.SMTPServerDisconnected('gone')
+
+            def close(self):
+                # Django's SMTP backend re-raises on close unless fail_silently
+                raise smtplib.SMTPException('close failed')
+
+        scheduler = MailScheduler(workers=2, per_second=0, max_retries=1, connection_factory=BrokenConnection)
+        messages = [(i, mail.EmailMessage('Hi', 'Body', to=[f'g{i}@example.com'])) for i in range(6)]
+        with self.assertLogs('guests.mail_scheduler', 'WARNING'):
+            results = dict(scheduler.send(iter(messages)))
+        self.assertEqual(sorted(results), list(range(6)))
+        self.assertTrue(all(isinstance(error, smtplib.SMTPServerDisconnected) for error in results.values()))
+
+    def test_token_bucket_limits_rate(self):
+        limiter = RateLimiter(per_second=50)
+        started = time.monotonic()
+        for _ in range(60):
+            limiter.acquire()
+        # 50 tokens of burst, then 10 more at 50 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+class EmailRenderingTests(EventFixture, TestCase):
+    login = True
+
+    def test_cached_render_matches_template_render(self):
+        invitation = self.event.invitations.select_related('guest', 'event').first()
+        invitation.guest.first_name = "O'Brien <b>"
+        for qr_image_url in (None, 'http://testserver/codes/x/qr.png?a=1&b=2'):
+            rsvp_url = 'http://testserver/rsvp/x/?a=1&b=2'
+            self.assertEqual(
+                render_invitation_email(invitation, rsvp_url, qr_image_url),
+                render_invitation_templates(invitation, rsvp_url, qr_image_url),
+            )
+
+    def test_event_render_invalidated_on_save(self):
+        render = event_render(self.event, with_qr=False)
+        self.assertIs(event_render(self.event, with_qr=False), render)
+        self.event.name = 'Renamed Event'
+        self.event.save()
+        render = event_render(self.event, with_qr=False)
+        self.assertIn('Renamed Event', render.render({
+            'first_name': 'A', 'last_name': 'B', 'full_name': 'A B', 'rsvp_url': '/', 'qr_image_url': '',
+        })[1])
+
+    def test_organizer_email_template_used_and_recompiled_on_edit(self):
+        template = EmailTemplate.objects.create(
+            name='Formal', template_type='invitation', is_default=True, created_by=self.user,
+            subject='{{ invitation.event.name }} for {{ invitation.guest.first_name }}',
+            html_content='<p>Dear {{ invitation.guest.full_name }}</p>',
+            text_content='Dear {{ invitation.guest.full_name }}, code {{ invitation.unique_code }}',
+        )
+        compiled = email_templates(self.event)
+        self.assertIs(email_templates(self.event), compiled)
+        self.client.post(reverse('bulk_resend_invitations', args=[self.event.id]))
+        process_queued_send_jobs()
+        message = mail.outbox[0]
+        invitation = Invitation.objects.get(guest__email=message.to[0])
+        self.assertEqual(message.subject, f'Test Event for {invitation.guest.first_name}')
+        # unique_code has no marker, so these emails are rendered per guest
+        self.assertIn(f'code {invitation.unique_code}', message.body)
+
+        template.subject = 'Updated'
+        template.save()
+        self.assertIsNot(compiled_email_template(template), compiled)
+        self.assertEqual(email_templates(self.event).subject.render({}), 'Updated')
+
+    @override_settings(CACHES={'codes': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_inline_qr_code_encoded_once(self):
+        encoded_code_image.cache_clear()
+        invitation = self.event.invitations.select_related('guest', 'event').first()
+        with mock.patch('guests.codes.render_code', wraps=codes.render_code) as render:
+            first = build_invitation_message(invitation, include_qr_code=True).message()
+            second = build_invitation_message(invitation, include_qr_code=True).message()
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.get_content_type(), 'multipart/related')
+        html = first.get_payload(0).get_payload(1).get_payload(decode=True).decode()
+        image = first.get_payload(1)
+        self.assertIn(f'src="cid:{image["Content-ID"][1:-1]}"', html)
+        self.assertEqual(image.get_payload(decode=True)[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(image.get_payload(), second.get_payload(1).get_payload())
+
+class TrackingTests(EventFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        EventAnalytics.objects.create(event=self.event)
+
+    @override_settings(TRACKING_FLUSH_INTERVAL=3600, TRACKING_FLUSH_THRESHOLD=10000)
+    def test_opens_and_clicks_are_buffered_and_flushed_in_aggregate(self):
+        tracking.flush()
+        first, second = self.event.invitations.all()[:2]
+        with self.assertNumQueries(0):
+            for _ in range(20):
+                response = self.client.get(reverse('track_open', args=[first.unique_code]))
+            self.client.get(reverse('track_open', args=[second.unique_code]))
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        response = self.client.get(reverse('track_click', args=[first.unique_code]))
+        self.assertRedirects(response, reverse('rsvp', args=[first.unique_code]), fetch_redirect_response=False)
+
+        # Find the events, mark the new opens, one increment for the event (and
+        # the savepoint of the transaction they share)
+        with self.assertNumQueries(5):
+            tracking.flush()
+        analytics = EventAnalytics.objects.get(event=self.event)
+        self.assertEqual((analytics.emails_opened, analytics.emails_clicked), (2, 1))
+        self.assertIsNotNone(Invitation.objects.get(pk=first.pk).opened_at)
+
+        # A later open of the same email is not counted again
+        self.client.get(reverse('track_open', args=[first.unique_code]))
+        tracking.flush()
+        self.assertEqual(EventAnalytics.objects.get(event=self.event).emails_opened, 2)
+
+class BounceTests(EventFixture, TestCase):
+    def setUp(self):
+        super().setUp()
+        EventAnalytics.objects.create(event=self.event)
+
+    def test_process_bounces_suppresses_guests(self):
+        self.event.invitations.update(status='sent', email_sent=True)
+        dsn = (
+            'From MAILER-DAEMON Mon Oct  5 10:00:00 2026\n'
+            'From: Mail Delivery System <MAILER-DAEMON@example.com>\n'
+            'Subject: Undelivered Mail Returned to Sender\n'
+            'MIME-Version: 1.0\n'
+            'Content-Type: multipart/report; report-type=delivery-status; boundary="b"\n\n'
+            '--b\nContent-Type: text/plain\n\n>From the mailer: delivery failed.\n\n'
+            '--b\nContent-Type: message/delivery-status\n\n'
+            'Reporting-MTA: dns; mx.example.com\n\n'
+            'Final-Recipient: rfc822; G1@Example.com\nAction: failed\nStatus: 5.1.1\n\n'
+            '--b--\n\n'
+            'From MAILER-DAEMON Mon Oct  5 10:01:00 2026\n'
+            'X-Failed-Recipients: nobody@example.com\nSubject: failure\n\nbody\n'
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.mbox', delete=False) as mbox:
+            mbox.write(dsn)
+        output = io.StringIO()
+        call_command('process_bounces', mbox.name, stdout=output)
+        self.assertIn('Read 2 message(s)', output.getvalue())
+        self.assertIn('2 bounced address(es), 1 not matching', output.getvalue())
+
+        bounced = Guest.objects.get(email='g1@example.com')
+        self.assertIsNotNone(bounced.email_bounced_at)
+        self.assertEqual(bounced.invitations.get().status, 'bounced')
+        self.assertEqual(EventAnalytics.objects.get(event=self.event).emails_bounced, 1)
+
+        job = queue_invitation_emails(self.event, self.event.invitations.all(), dispatch=False)
+        self.assertEqual(job.total, 2)
+
+    def test_process_bounces_dry_run_counts_each_guest_once(self):
+        bounce = 'From MAILER-DAEMON Mon Oct  5 10:00:00 2026\nX-Failed-Recipients: g1@example.com\nSubject: failure\n\nbody\n\n'
+        with tempfile.NamedTemporaryFile('w', suffix='.mbox', delete=False) as mbox:
+            mbox.write(bounce * 3)
+        result = process_bounces(mbox.name, batch_size=1, dry_run=True)
+        self.assertEqual((result.bounces, result.guests), (3, 1))
+        self.assertFalse(Guest.objects.filter(email_bounced_at__isnull=False).exists())
+
+class ReminderTests(EventFixture, TestCase):
+    def test_reminders_go_only_to_guests_without_rsvp(self):
+        self.event.rsvp_deadline = timezone.now() + datetime.timedelta(days=1)
+        self.event.save()
+        self.event.invitations.update(status='sent', email_sent=True)
+        answered, *waiting = self.event.invitations.order_by('pk')
+        RSVP.objects.create(invitation=answered, response='yes')
+
+        output = io.StringIO()
+        call_command('send_reminders', stdout=output)
+        self.assertIn('2 reminder(s) sent', output.getvalue())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         sorted(invitation.guest.email for invitation in waiting))
+        self.assertTrue(mail.outbox[0].subject.startswith('Reminder: please RSVP'))
+        self.assertEqual(list(self.event.invitations.order_by('pk').values_list('reminder_count', flat=True)), [0, 1, 1])
+
+        # Both reminders were due, but guests get one per run and nothing twice
+        call_command('send_reminders', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_reminder_keeps_invitation_status(self):
+        self.event.rsvp_deadline = timezone.now() + datetime.timedelta(days=1)
+        self.event.save()
+        first_sent = timezone.now() - datetime.timedelta(days=20)
+        self.event.invitations.update(status='opened', email_sent=True, email_sent_at=first_sent)
+        call_command('send_reminders', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            set(self.event.invitations.values_list('status', 'email_sent_at', 'reminder_count')),
+            {('opened', first_sent, 1)},
+        )
+
+class ImportTests(EventFixture, TestCase):
+    guest_count = 5
+    invite = False
+
+    def import_csv(self, **options):
+        Invitation.objects.bulk_invite(self.event, self.guests[:1])
+        rows = 'first_name,last_name,email,phone,address\n'
+        rows += 'Guest0,Doe,g0@example.com,,\n'      # existing and invited
+        rows += 'Guest1,Doe,g1@example.com,,\n'      # existing
+        rows += ''.join(f'New{i},Roe,n{i}@example.com,555,"{i} Main St, Lusaka"\n' for i in range(5))
+        rows += 'New0,Roe,n0@example.com,,Elsewhere\n'     # repeated within the file
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write(rows)
+        output = io.StringIO()
+        call_command('import_guests', csv_file.name, event_id=self.event.pk, create_invitations=True,
+                     stdout=output, **options)
+        return output.getvalue()
+
+    def test_import_guests_in_chunks(self):
+        output = self.import_csv(chunk_size=3)
+        self.assertIn('Guests created: 5', output)
+        self.assertIn('Existing guests: 3', output)
+        self.assertIn('Invitations created: 6', output)
+        self.assertEqual(Guest.objects.count(), 10)
+        self.assertEqual(self.event.invitations.count(), 7)
+
+    def test_fast_import_through_staging_table(self):
+        output = self.import_csv(fast=True)
+        self.assertIn('Guests created: 5', output)
+        self.assertIn('Existing guests: 3', output)
+        self.assertIn('Invitations created: 6', output)
+        self.assertEqual(Guest.objects.count(), 10)
+        self.assertEqual(self.event.invitations.count(), 7)
+        guest = Guest.objects.get(email='n1@example.com')
+        self.assertEqual(guest.address, '1 Main St, Lusaka')
+        # The first of the repeated rows is kept, not a mix of both
+        repeated = Guest.objects.get(email='n0@example.com')
+        self.assertEqual((repeated.phone, repeated.address), ('555', '0 Main St, Lusaka'))
+        self.assertIsNotNone(guest.created_at)
+        invitation = guest.invitations.get()
+        self.assertEqual(invitation.status, 'draft')
+        self.assertTrue(invitation.barcode)
+        # A second run finds everything already there
+        output = self.import_csv(fast=True)
+        self.assertIn('Guests created: 0', output)
+        self.assertIn('Invitations created: 0', output)
+
+    def test_import_validates_rows_first(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write(
+                'first_name,last_name,email,phone,address\n'
+                '  ann ,BANDA,Ann@Example.COM,(0977) 123-456,\n'
+                'Ann,Banda,ann@example.com,,\n'
+                '   ,Phiri,p@example.com,,\n'
+                'Bo,Mwale,bo@example,12ab,\n'
+            )
+        rejects = f'{csv_file.name}.rejects.csv'
+        output = io.StringIO()
+        call_command('import_guests', csv_file.name, validate=True, rejects=rejects, chunk_size=2, stdout=output)
+        self.assertIn('Guests created: 1', output.getvalue())
+        self.assertIn('1 of 4 rows valid, 3 rejected', output.getvalue())
+        guest = Guest.objects.get(email='ann@example.com')
+        self.assertEqual((guest.first_name, guest.last_name, guest.phone), ('Ann', 'Banda', '0977123456'))
+        with open(rejects) as rejects_file:
+            rejected = list(csv.DictReader(rejects_file))
+        self.assertEqual([row['row'] for row in rejected], ['3', '4', '5'])
+        self.assertEqual(rejected[0]['reason'], 'duplicate in file')
+        self.assertEqual(rejected[2]['reason'], 'invalid email; invalid phone')
+
+    def test_guest_resource_import(self):
+        dataset = GuestResource().export()
+        self.assertEqual(dataset.headers, list(IMPORT_FIELDS))
+        dataset.append(['New', 'Guest', 'new@example.com', '', ''])
+        result = GuestResource().import_data(dataset)
+        self.assertFalse(result.has_errors())
+        self.assertEqual((result.totals['new'], result.totals['skip']), (1, 5))
+
+class RosterExportTests(EventFixture, TestCase):
+    guest_count = 5
+    invite = False
+
+    def test_export_event_roster(self):
+        Invitation.objects.bulk_invite(self.event, self.guests[:3])
+        path = os.path.join(tempfile.mkdtemp(), 'roster.csv')
+        output = io.StringIO()
+        call_command('export_guests', path, event_id=self.event.pk, chunk_size=2, stdout=output)
+        self.assertIn('Exported 3 rows', output.getvalue())
+        with open(path) as roster_file:
+            rows = list(csv.DictReader(roster_file))
+        self.assertEqual(rows[0]['email'], 'g0@example.com')
+        self.assertEqual(rows[0]['status'], 'draft')
+        self.assertEqual(len(rows[0]['unique_code']), 36)
+
+    def round_trip(self, file_format):
+        path = os.path.join(tempfile.mkdtemp(), f'roster.{file_format}')
+        self.assertEqual(export_roster(path, chunk_size=2), 5)
+        Guest.objects.all().delete()
+        output = io.StringIO()
+        call_command('import_guests', path, validate=True, chunk_size=2, stdout=output)
+        self.assertIn('Guests created: 5', output.getvalue())
+        self.assertEqual(Guest.objects.filter(email='g4@example.com').count(), 1)
+
+    def test_xlsx_round_trip(self):
+        self.round_trip('xlsx')
+
+    def test_parquet_round_trip(self):
+        self.round_trip('parquet')
+
+class GuestListExportTests(EventFixture, TestCase):
+    def test_guest_list_export(self):
+        invitation = self.event.invitations.get(guest__first_name='Guest0')
+        RSVP.objects.create(invitation=invitation, response='yes', plus_ones=2,
+                            dietary_restrictions='=HYPERLINK("http://example.com")')
+        invitation.check_in_guest()
+        self.assertEqual(len(list(stream_guest_list(self.event, block_size=2))), 3)
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('event_guest_list_export', args=[self.event.id, 'tsv']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/tab-separated-values; charset=utf-8')
+        content = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content), delimiter='\t'))
+        self.assertEqual([row['First name'] for row in rows], ['Guest0', 'Guest1', 'Guest2'])
+        self.assertEqual(rows[0]['RSVP'], 'Yes, I will attend')
+        self.assertEqual(rows[0]['Plus-ones'], '2')
+        self.assertEqual(rows[0]['Dietary restrictions'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(rows[0]['Checked in'], 'Yes')
+        self.assertTrue(rows[0]['Check-in time'])
+        self.assertEqual(rows[1]['RSVP'], 'No response')
+        response = self.client.get(reverse('event_guest_list_export', args=[self.event.id, 'xls']))
+        self.assertEqual(response.status_code, 404)
+
+class TrackingFlushTests(EventFixture, TransactionTestCase):
+    guest_count = 1
+
+    @override_settings(TRACKING_FLUSH_INTERVAL=0.2, TRACKING_FLUSH_THRESHOLD=10000)
+    def test_lone_hit_is_flushed_without_later_traffic(self):
+        invitation = self.event.invitations.get()
+        tracking.flush()
+        flushed = threading.Event()
+
+        def flush():
+            real_flush()
+            flushed.set()
+
+        real_flush = tracking.flush
+        with mock.patch.object(tracking, 'flush', flush):
+            tracking.record_open(invitation.unique_code)
+            # No further hits: the background thread has to write it
+            self.assertTrue(flushed.wait(5), 'buffered hit was never flushed')
+        self.assertIsNotNone(Invitation.objects.get(pk=invitation.pk).opened_at)
+        self.assertEqual(EventAnalytics.objects.get(event=self.event).emails_opened, 1)
@@ -0,0 +1,259 @@
+"""
+Printable ticket sheets for an event.
+
+Tickets are laid out N to an A4 page and written as a PDF stream: rows are
+read from the database a chunk at a time, pages are rendered (and
+compressed) in a worker pool, and each page is written out as soon as it
+is ready. Only a few pages are held in memory at once, whatever the size
+of the event.
+"""
+import logging
+import zlib
+from collections import deque
+from itertools import islice
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .codes import barcode_modules, default_worker_count, encode_barcode, qr_matrix, qr_payload, worker_pool
+
+logger = logging.getLogger(__name__)
+
+# A4 at 200 dpi; the page image is scaled to the PDF page size (in points).
+PAGE_SIZE = (1654, 2339)
+PAGE_POINTS = (595.28, 841.89)
+PAGE_MARGIN = 60
+
+DEFAULT_COLUMNS = 2
+DEFAULT_ROWS = 4
+
+TICKET_FIELDS = (
+    'pk',
+    'unique_code',
+    'barcode_number',
+    'guest__first_name',
+    'guest__last_name',
+    'table_number',
+    'seat_number',
+)
+
+
+def ticket_rows(invitations, chunk_size=500):
+    """
+    Yield ticket data for a queryset of invitations, ordered by primary key.
+
+    Rows are fetched with keyset pagination rather than a server-side cursor,
+    so no query is left open while pages are being rendered.
+    """
+    last_pk = 0
+    while True:
+        chunk = list(
+            invitations.filter(pk__gt=last_pk).order_by('pk').values_list(*TICKET_FIELDS)[:chunk_size]
+        )
+        for pk, unique_code, barcode_number, first_name, last_name, table, seat in chunk:
+            yield {
+                'name': f'{first_name} {last_name}',
+                'table': table or '',
+                'seat': seat or '',
+                'qr': qr_payload(unique_code),
+                'barcode': barcode_number or encode_barcode(pk),
+            }
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+
+def _fit_text(draw, text, font, width):
+    """Shorten text with an ellipsis until it fits the given width"""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _draw_qr(draw, payload, left, top, size):
+    matrix = qr_matrix(payload)
+    scale = max(1, size // len(matrix))
+    for y, row in enumerate(matrix):
+        for x, dark in enumerate(row):
+            if dark:
+                x0, y0 = left + x * scale, top + y * scale
+                draw.rectangle([x0, y0, x0 + scale - 1, y0 + scale - 1], fill=0)
+    return len(matrix) * scale
+
+
+def _draw_barcode(draw, value, left, top, width, height, quiet_zone=10):
+    modules = barcode_modules(value)
+    scale = max(1, width // (len(modules) + 2 * quiet_zone))
+    left += quiet_zone * scale
+    for x, bar in enumerate(modules):
+        if bar == '1':
+            x0 = left + x * scale
+            draw.rectangle([x0, top, x0 + scale - 1, top + height - 1], fill=0)
+    return left, len(modules) * scale
+
+
+def _draw_ticket(draw, ticket, event_name, box, fonts):
+    left, top, right, bottom = box
+    pad = 24
+    width = right - left - 2 * pad
+    draw.rectangle(box, outline=0, width=2)
+
+    y = top + pad
+    draw.text((left + pad, y), _fit_text(draw, event_name, fonts['small'], width),
+              font=fonts['small'], fill=0)
+    y += 44
+
+    qr_size = min(bottom - y - pad - 130, width // 2)
+    qr_drawn = _draw_qr(draw, ticket['qr'], right - pad - qr_size, y, qr_size)
+
+    text_width = width - qr_drawn - pad
+    draw.text((left + pad, y), _fit_text(draw, ticket['name'], fonts['large'], text_width),
+              font=fonts['large'], fill=0)
+    if ticket['table']:
+        draw.text((left + pad, y + 64), f"Table {ticket['table']}", font=fonts['medium'], fill=0)
+    if ticket['seat']:
+        draw.text((left + pad, y + 110), f"Seat {ticket['seat']}", font=fonts['medium'], fill=0)
+
+    barcode_top = bottom - pad - 120
+    barcode_left, barcode_width = _draw_barcode(draw, ticket['barcode'], left + pad, barcode_top, width, 84)
+    draw.text((barcode_left + barcode_width // 2, barcode_top + 90), ticket['barcode'],
+              font=fonts['small'], fill=0, anchor='mt')
+
+
+def render_ticket_page(job):
+    """
+    Worker entry point: render one page of tickets.
+
+    Returns the page as a 1-bit image, already Flate-compressed, together
+    with its pixel size.
+    """
+    event_name, tickets, columns, rows = job
+    image = Image.new('1', PAGE_SIZE, 1)
+    draw = ImageDraw.Draw(image)
+    fonts = {
+        'small': ImageFont.load_default(size=26),
+        'medium': ImageFont.load_default(size=34),
+        'large': ImageFont.load_default(size=44),
+    }
+    cell_width = (PAGE_SIZE[0] - 2 * PAGE_MARGIN) // columns
+    cell_height = (PAGE_SIZE[1] - 2 * PAGE_MARGIN) // rows
+    for index, ticket in enumerate(tickets):
+        left = PAGE_MARGIN + (index % columns) * cell_width
+        top = PAGE_MARGIN + (index // columns) * cell_height
+        box = (left + 8, top + 8, left + cell_width - 8, top + cell_height - 8)
+        _draw_ticket(draw, ticket, event_name, box, fonts)
+    return image.size, zlib.compress(image.tobytes(), 6)
+
+
+def _pages(event_name, tickets, columns, rows):
+    per_page = columns * rows
+    tickets = iter(tickets)
+    while True:
+        page = list(islice(tickets, per_page))
+        if not page:
+            return
+        yield event_name, page, columns, rows
+
+
+def render_pages(jobs, workers=1):
+    """
+    Render page jobs in order.
+
+    With more than one worker the pages are rendered in a pool of spawned
+    processes, with at most a few pages per worker in flight at a time.
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield render_ticket_page(job)
+        return
+
+    with worker_pool(workers) as executor:
+        in_flight = deque()
+        for job in jobs:
+            in_flight.append(executor.submit(render_ticket_page, job))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class PDFWriter:
+    """Minimal PDF writer that emits each page as soon as it is added"""
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+
+    def _object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.offset
+        chunk = f'{obj_id} 0 obj\n'.encode() + body
+        if stream is not None:
+            chunk += b'\nstream\n' + stream + b'\nendstream'
+        chunk += b'\nendobj\n'
+        self.offset += len(chunk)
+        return chunk
+
+    def header(self):
+        chunk = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.offset += len(chunk)
+        return chunk + self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    def page(self, size, data):
+        """Add a 1-bit page image (Flate-compressed rows) filling the page"""
+        page_id = 3 + 3 * len(self.page_ids)
+        content_id, image_id = page_id + 1, page_id + 2
+        self.page_ids.append(page_id)
+        width, height = size
+        page_width, page_height = PAGE_POINTS
+        content = f'q {page_width} 0 0 {page_height} 0 0 cm /Im0 Do Q'.encode()
+        return b''.join([
+            self._object(page_id, (
+                f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] '
+                f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>'
+            ).encode()),
+            self._object(content_id, f'<< /Length {len(content)} >>'.encode(), content),
+            self._object(image_id, (
+                f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                f'/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode '
+                f'/Length {len(data)} >>'
+            ).encode(), data),
+        ])
+
+    def footer(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        chunk = self._object(
+            2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>'.encode()
+        )
+        xref_offset = self.offset
+        size = max(self.offsets) + 1
+        lines = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        for obj_id in range(1, size):
+            lines.append(f'{self.offsets[obj_id]:010d} 00000 n \n')
+        lines.append(f'trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n')
+        return chunk + ''.join(lines).encode()
+
+
+def stream_ticket_pdf(event, invitations=None, workers=None, columns=DEFAULT_COLUMNS,
+                      rows=DEFAULT_ROWS, chunk_size=500):
+    """
+    Yield a PDF of tickets for an event, chunk by chunk.
+
+    ``invitations`` defaults to all of the event's invitations. Pages are
+    rendered by ``workers`` processes (one per core by default), or in this
+    process with one worker.
+    """
+    if invitations is None:
+        invitations = event.invitations.all()
+    workers = max(1, workers or default_worker_count())
+    jobs = _pages(event.name, ticket_rows(invitations, chunk_size), columns, rows)
+
+    writer = PDFWriter()
+    yield writer.header()
+    pages = 0
+    for size, data in render_pages(jobs, workers):
+        pages += 1
+        yield writer.page(size, data)
+    yield writer.footer()
+    logger.info(f"Ticket sheet for event {event.pk} generated: {pages} page(s)")
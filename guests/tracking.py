@@ -0,0 +1,136 @@
+"""
+Email open and click tracking.
+
+Opens (a 1x1 pixel in the HTML email) and clicks (a redirect in front of the
+RSVP link) are only buffered in memory when they happen. The buffer is
+flushed as one aggregated F() increment per event on EventAnalytics: by a
+background thread every TRACKING_FLUSH_INTERVAL seconds, by the request that
+fills it to TRACKING_FLUSH_THRESHOLD hits, and when the process exits. A
+burst of opens after a large send therefore costs a few UPDATEs per flush
+instead of one row-locking UPDATE per hit.
+
+Hits buffered in a process that is killed outright are lost, which is
+acceptable for these statistics.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EventAnalytics, Invitation
+
+logger = logging.getLogger(__name__)
+
+# A transparent 1x1 GIF
+PIXEL_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+_opened = set()       # unique codes of invitations opened or clicked
+_clicks = Counter()   # clicks per unique code
+_hits = 0
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+_flusher = None
+
+
+def increment_analytics(event_id, **counts):
+    """Add to an event's EventAnalytics counters with one UPDATE"""
+    counts = {name: F(name) + value for name, value in counts.items() if value}
+    if not counts:
+        return
+    if not EventAnalytics.objects.filter(event_id=event_id).update(**counts):
+        EventAnalytics.objects.get_or_create(event_id=event_id)
+        EventAnalytics.objects.filter(event_id=event_id).update(**counts)
+
+
+def record_open(code):
+    _record(code)
+
+
+def record_click(code):
+    _record(code, click=True)
+
+
+def _start_flusher():
+    """Start this process's background flush thread if it is not running"""
+    global _flusher
+    with _lock:
+        # Threads do not survive a fork, so a forked worker starts its own
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_periodically, name='email-tracking-flush', daemon=True)
+            _flusher.start()
+
+
+def _flush_periodically():
+    while True:
+        # Wake up often enough to follow a changed interval
+        time.sleep(min(settings.TRACKING_FLUSH_INTERVAL, 1))
+        if _hits and time.monotonic() - _last_flush >= settings.TRACKING_FLUSH_INTERVAL:
+            try:
+                flush()
+            finally:
+                # The thread's connection would otherwise stay open between flushes
+                connection.close()
+
+
+def _record(code, click=False):
+    global _hits
+    _start_flusher()
+    with _lock:
+        # A click means the email was opened, even if the pixel was blocked
+        _opened.add(code)
+        if click:
+            _clicks[code] += 1
+        _hits += 1
+        due = (
+            _hits >= settings.TRACKING_FLUSH_THRESHOLD
+            or time.monotonic() - _last_flush >= settings.TRACKING_FLUSH_INTERVAL
+        )
+    if due:
+        flush()
+
+
+def flush():
+    """
+    Write buffered hits to the database: set ``opened_at`` on newly opened
+    invitations and increment the events' open and click counters.
+    """
+    global _opened, _clicks, _hits, _last_flush
+    with _lock:
+        opened, clicks = _opened, _clicks
+        _opened, _clicks, _hits, _last_flush = set(), Counter(), 0, time.monotonic()
+    if not opened:
+        return
+
+    try:
+        codes_by_event = {}
+        for code, event_id in Invitation.objects.filter(unique_code__in=opened).values_list('unique_code', 'event_id'):
+            codes_by_event.setdefault(event_id, []).append(code)
+        now = timezone.now()
+        # The counters are committed with the opens, so neither is seen without the other
+        with transaction.atomic():
+            for event_id, codes in codes_by_event.items():
+                # Only the UPDATE that sets opened_at counts an open, so concurrent
+                # flushes from other processes never count one twice
+                newly_opened = Invitation.objects.filter(
+                    unique_code__in=codes, opened_at__isnull=True
+                ).update(opened_at=now)
+                increment_analytics(
+                    event_id,
+                    emails_opened=newly_opened,
+                    emails_clicked=sum(clicks[code] for code in codes),
+                )
+    except Exception:
+        logger.exception(f"Could not record {len(opened)} email tracking hit(s)")
+
+
+# Write what is still buffered when the worker shuts down
+atexit.register(flush)
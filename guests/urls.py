@@ -18,16 +18,26 @@ urlpatterns = [
     # RSVP URLs
     path('rsvp/<uuid:code>/', views.rsvp_response, name='rsvp'),
     path('qr/<uuid:code>/', views.qr_code_view, name='qr_code'),
+    path('codes/<uuid:code>/<slug:kind>.<slug:fmt>', views.invitation_code_image, name='invitation_code_image'),
+    
+    # Email open/click tracking
+    path('t/<uuid:code>/open.gif', views.track_open, name='track_open'),
+    path('t/<uuid:code>/click/', views.track_click, name='track_click'),
     
     # Event management URLs
     path('event/<int:event_id>/dashboard/', views.event_dashboard, name='event_dashboard'),
     path('event/<int:event_id>/send-invitations/', views.send_invitations, name='send_invitations'),
     path('event/<int:event_id>/add-guest/', views.add_guest, name='add_guest_to_event'),
     path('event/<int:event_id>/seating-chart/', views.seating_chart, name='seating_chart'),
+    path('event/<int:event_id>/tickets.pdf', views.event_tickets_pdf, name='event_tickets_pdf'),
+    path('event/<int:event_id>/guests.<str:file_format>', views.event_guest_list_export,
+         name='event_guest_list_export'),
     
     # Invitation management
     path('invitation/<int:invitation_id>/resend/', views.resend_invitation, name='resend_invitation'),
     path('event/<int:event_id>/bulk-resend-invitations/', views.bulk_resend_invitations, name='bulk_resend_invitations'),
+    path('send-jobs/<int:job_id>/progress/', views.send_job_progress, name='send_job_progress'),
+    path('send-jobs/<int:job_id>/<str:action>/', views.send_job_control, name='send_job_control'),
     
     # Guest management URLs
     path('add-guest/', views.add_guest, name='add_guest'),
@@ -0,0 +1,118 @@
+"""
+Vectorized validation of guest import files.
+
+The file is read in chunks of rows into pandas DataFrames. Each chunk is normalized (surrounding
+and repeated whitespace, email case, all-lower or all-upper names, phone
+punctuation) and checked with column-wide regexes; duplicates are found
+with ``duplicated()`` within the chunk and against the keys of earlier
+chunks. Rejected rows are written to a rejects CSV, rewritten on every run,
+with their row number and reasons; only the clean rows of each chunk are
+passed on to the import.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import islice
+
+import pandas as pd
+
+from .importing import IMPORT_FIELDS, guess_format, read_rows
+
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s.]+$'
+# Digits with an optional leading +, once spaces, dots, dashes and brackets are removed
+PHONE_PATTERN = r'^\+?\d{7,15}$'
+PHONE_PUNCTUATION = r'[\s().-]'
+
+NAME_MAX_LENGTH = 100
+EMAIL_MAX_LENGTH = 254
+
+
+@dataclass
+class ValidationResult:
+    rows: int = 0
+    valid: int = 0
+    rejected: int = 0
+    reasons: Counter = field(default_factory=Counter)
+
+
+def normalize(frame):
+    """Normalized copy of a chunk of raw rows"""
+    frame = frame.apply(lambda column: column.str.strip())
+    for name in ('first_name', 'last_name'):
+        column = frame[name].str.replace(r'\s+', ' ', regex=True)
+        # Fix names typed in one case; leave mixed case (McDonald) alone
+        one_case = column.str.islower() | column.str.isupper()
+        frame[name] = column.where(~one_case, column.str.title())
+    frame['email'] = frame['email'].str.lower()
+    frame['phone'] = frame['phone'].str.replace(PHONE_PUNCTUATION, '', regex=True)
+    return frame
+
+
+def rejection_reasons(frame, seen_keys):
+    """Each row's reasons for rejection, '' for clean rows; adds the clean keys to ``seen_keys``"""
+    keys = frame['first_name'] + '\x1f' + frame['last_name'] + '\x1f' + frame['email']
+    checks = [
+        (frame['first_name'].eq(''), 'missing first name'),
+        (frame['last_name'].eq(''), 'missing last name'),
+        (frame['first_name'].str.len().gt(NAME_MAX_LENGTH)
+         | frame['last_name'].str.len().gt(NAME_MAX_LENGTH), 'name too long'),
+        (~frame['email'].str.match(EMAIL_PATTERN) | frame['email'].str.len().gt(EMAIL_MAX_LENGTH),
+         'invalid email'),
+        (frame['phone'].ne('') & ~frame['phone'].str.match(PHONE_PATTERN), 'invalid phone'),
+        (keys.duplicated() | keys.isin(seen_keys), 'duplicate in file'),
+    ]
+    reasons = pd.Series('', index=frame.index)
+    for failed, reason in checks:
+        reasons[failed] += reason + '; '
+    reasons = reasons.str.rstrip('; ')
+    seen_keys.update(keys[reasons.eq('')])
+    return reasons
+
+
+def row_chunks(rows, chunk_size=10000):
+    """DataFrames of ``chunk_size`` row dicts, indexed by row position"""
+    rows = iter(rows)
+    start = 0
+    while chunk := list(islice(rows, chunk_size)):
+        yield pd.DataFrame(chunk, index=range(start, start + len(chunk)), dtype=str).fillna('')
+        start += len(chunk)
+
+
+def file_chunks(path, file_format=None, chunk_size=10000):
+    """DataFrames of the rows of a CSV, XLSX or Parquet file"""
+    if (file_format or guess_format(path)) == 'csv':
+        return pd.read_csv(
+            path, chunksize=chunk_size, dtype=str, keep_default_na=False, na_filter=False, encoding='utf-8'
+        )
+    return row_chunks(read_rows(path, file_format), chunk_size)
+
+
+def validated_frames(chunks, rejects_path, result=None):
+    """
+    Yield the clean, normalized rows of each DataFrame of ``chunks``,
+    writing rejected rows to ``rejects_path``. ``result`` is updated as
+    chunks are read.
+    """
+    result = result if result is not None else ValidationResult()
+    seen_keys = set()
+    pd.DataFrame(columns=[*IMPORT_FIELDS, 'row', 'reason']).to_csv(rejects_path, index=False)
+    for chunk in chunks:
+        raw = chunk.reindex(columns=IMPORT_FIELDS, fill_value='')
+        frame = normalize(raw)
+        reasons = rejection_reasons(frame, seen_keys)
+        rejected = reasons.ne('')
+        result.rows += len(frame)
+        result.rejected += int(rejected.sum())
+        result.valid += len(frame) - int(rejected.sum())
+        if rejected.any():
+            for row_reasons in reasons[rejected]:
+                result.reasons.update(row_reasons.split('; '))
+            # Rejects keep the values as they were in the file; the header is row 1
+            rejects = raw[rejected].assign(row=raw.index[rejected] + 2, reason=reasons[rejected])
+            rejects.to_csv(rejects_path, mode='a', header=False, index=False)
+        yield frame[~rejected]
+
+
+def validated_rows(frames):
+    """The rows of validated frames as dicts, for the import functions"""
+    for frame in frames:
+        yield from frame.to_dict('records')
@@ -1,17 +1,27 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate
 from django.utils import timezone
 from django.db.models import Count, Q
 from django_ratelimit.decorators import ratelimit
-from .models import Event, Guest, Invitation, RSVP
+from .models import EmailTemplate, Event, Guest, Invitation, RSVP, SendJob
 from .forms import RSVPForm, GuestForm, GuestProfileForm, UserProfileForm, GuestRegistrationForm
+from .codes import (
+    CODE_FORMATS, CODE_KINDS, code_etag, code_payload, decode_barcode, encode_barcode,
+    get_code_image, is_legacy_barcode,
+)
+from .emails import (
+    cancel_send_job, pause_send_job, queue_invitation_emails, resume_send_job, send_invitation_email,
+)
+from .exporting import GUEST_LIST_FORMATS, stream_guest_list
+from .tickets import stream_ticket_pdf
+from . import tracking
 import logging
 
 logger = logging.getLogger(__name__)
@@ -153,6 +163,7 @@ def event_dashboard(request, event_id):
     context = {
         'event': event,
         'invitations': invitations,
+        'send_job': event.send_jobs.first(),
         'stats': {
             'total_invitations': total_invitations,
             'rsvp_yes': rsvp_yes,
@@ -172,33 +183,27 @@ def send_invitations(request, event_id):
     event = get_object_or_404(Event, id=event_id, created_by=request.user)
     
     if request.method == 'POST':
-        invitation_ids = request.POST.getlist('invitation_ids')
+        invitation_ids = [i for i in request.POST.getlist('invitation_ids') if i.isdigit()]
         resend = request.POST.get('resend', 'false') == 'true'
-        sent_count = 0
+        include_qr_code = bool(request.POST.get('include_qr_code'))
+        template = EmailTemplate.objects.filter(
+            id=request.POST.get('template') or None, created_by=request.user, template_type='invitation'
+        ).first()
         
         logger.info(f"User {request.user.username} sending invitations for event {event.name}")
         
-        for invitation_id in invitation_ids:
-            try:
-                invitation = Invitation.objects.get(id=invitation_id, event=event)
-                # Send if not sent before OR if explicitly resending
-                if not invitation.email_sent or resend:
-                    send_invitation_email(invitation, request)
-                    invitation.email_sent = True
-                    invitation.email_sent_at = timezone.now()
-                    invitation.status = 'sent'
-                    invitation.save(update_fields=['email_sent', 'email_sent_at', 'status'])
-                    sent_count += 1
-            except Invitation.DoesNotExist:
-                logger.warning(f"Invitation {invitation_id} not found for event {event.id}")
-                continue
-        
-        logger.info(f"Sent {sent_count} invitations for event {event.name}")
+        invitations = event.invitations.filter(id__in=invitation_ids)
+        # Send if not sent before OR if explicitly resending
+        if not resend:
+            invitations = invitations.filter(email_sent=False)
+        job = queue_invitation_emails(
+            event, invitations, request.user, request, include_qr_code=include_qr_code, template=template
+        )
         
-        if resend:
-            messages.success(request, f'Successfully resent {sent_count} invitation(s)!')
+        if job:
+            messages.success(request, f'{job.total} invitation(s) queued for sending. Progress is shown below.')
         else:
-            messages.success(request, f'Successfully sent {sent_count} invitation(s)!')
+            messages.info(request, 'No invitations to send.')
         return redirect('event_dashboard', event_id=event.id)
     
     # Get invitations that haven't been sent yet
@@ -206,35 +211,10 @@ def send_invitations(request, event_id):
     
     return render(request, 'guests/send_invitations.html', {
         'event': event,
-        'pending_invitations': pending_invitations
+        'pending_invitations': pending_invitations,
+        'email_templates': EmailTemplate.objects.filter(created_by=request.user, template_type='invitation'),
     })
 
-def send_invitation_email(invitation, request=None):
-    """Send invitation email to a guest"""
-    subject = f"You're invited to {invitation.event.name}!"
-    
-    # Create RSVP URL
-    rsvp_url = invitation.get_rsvp_url()
-    if request:
-        rsvp_url = request.build_absolute_uri(rsvp_url)
-    
-    context = {
-        'invitation': invitation,
-        'rsvp_url': rsvp_url,
-    }
-    
-    html_message = render_to_string('guests/invitation_email.html', context)
-    plain_message = render_to_string('guests/invitation_email.txt', context)
-    
-    send_mail(
-        subject=subject,
-        message=plain_message,
-        html_message=html_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[invitation.guest.email],
-        fail_silently=False,
-    )
-
 @login_required
 def add_guest(request, event_id=None):
     """Add a new guest and optionally create invitation and send email"""
@@ -288,16 +268,98 @@ def add_guest(request, event_id=None):
 
 def qr_code_view(request, code):
     """Display QR code for an invitation"""
-    invitation = get_object_or_404(Invitation, code=code)
-    
-    # Generate QR code if it doesn't exist
-    if not invitation.qr_code:
-        invitation.generate_qr_code()
+    invitation = get_object_or_404(Invitation.objects.select_related('guest', 'event'), unique_code=code)
     
     return render(request, 'guests/qr_code.html', {
         'invitation': invitation,
     })
 
+def invitation_code_image(request, code, kind, fmt):
+    """
+    Serve an invitation's QR code or barcode, rendering it on first request.
+    Only URLs versioned with the current ETag are cached for long; others
+    must be revalidated, as a barcode can be reissued.
+    """
+    if kind not in CODE_KINDS or fmt not in CODE_FORMATS:
+        raise Http404
+    pk, barcode_number = get_object_or_404(
+        Invitation.objects.values_list('pk', 'barcode_number'), unique_code=code
+    )
+    payload = code_payload(kind, code, barcode_number or encode_barcode(pk))
+    etag = f'"{code_etag(kind, payload, fmt)}"'
+    
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(get_code_image(kind, payload, fmt), content_type=CODE_FORMATS[fmt])
+    response['ETag'] = etag
+    if request.GET.get('v') == etag.strip('"'):
+        patch_cache_control(response, public=True, max_age=settings.CODE_IMAGE_MAX_AGE)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+@never_cache
+def track_open(request, code):
+    """Tracking pixel: count an email open"""
+    tracking.record_open(code)
+    return HttpResponse(tracking.PIXEL_GIF, content_type='image/gif')
+
+@never_cache
+def track_click(request, code):
+    """Count a click on an email link, then go to the RSVP page"""
+    tracking.record_click(code)
+    return redirect('rsvp', code=code)
+
+@login_required
+def send_job_progress(request, job_id):
+    """Progress of a background email send job as JSON"""
+    job = get_object_or_404(SendJob, id=job_id, event__created_by=request.user)
+    return JsonResponse(job.progress())
+
+@login_required
+def send_job_control(request, job_id, action):
+    """Pause, resume or cancel a background email send job"""
+    job = get_object_or_404(SendJob, id=job_id, event__created_by=request.user)
+    actions = {
+        'pause': (pause_send_job, 'paused; it stops after the current batch'),
+        'resume': (resume_send_job, 'resumed'),
+        'cancel': (cancel_send_job, 'cancelled'),
+    }
+    if request.method == 'POST' and action in actions:
+        func, done = actions[action]
+        if func(job.id):
+            messages.success(request, f'Sending invitation emails {done}.')
+            logger.info(f"User {request.user.username} sent {action} to send job {job.id}")
+        else:
+            messages.info(request, f'That send job is already {job.get_status_display().lower()}.')
+    return redirect('event_dashboard', event_id=job.event_id)
+
+@login_required
+def event_tickets_pdf(request, event_id):
+    """Stream a printable PDF of tickets for every invitation of an event"""
+    event = get_object_or_404(Event, id=event_id, created_by=request.user)
+    response = StreamingHttpResponse(
+        stream_ticket_pdf(event, workers=settings.TICKET_PDF_WORKERS),
+        content_type='application/pdf',
+    )
+    response['Content-Disposition'] = f'attachment; filename="tickets_event_{event.id}.pdf"'
+    return response
+
+@login_required
+def event_guest_list_export(request, event_id, file_format):
+    """Stream an event's guest list with RSVPs as a CSV or TSV download"""
+    event = get_object_or_404(Event, id=event_id, created_by=request.user)
+    if file_format not in GUEST_LIST_FORMATS:
+        raise Http404('Unknown export format')
+    content_type, delimiter = GUEST_LIST_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        stream_guest_list(event, delimiter=delimiter),
+        content_type=f'{content_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="guests_event_{event.id}.{file_format}"'
+    return response
+
 def analytics_placeholder(request):
     """Placeholder analytics dashboard"""
     return render(request, 'guests/analytics_placeholder.html', {
@@ -330,10 +392,19 @@ def scan_barcode(request):
         barcode_number = request.POST.get('barcode_number', '').strip()
         
         if barcode_number:
-            try:
-                invitation = Invitation.objects.select_related('guest', 'event').get(barcode_number=barcode_number)
-            except Invitation.DoesNotExist:
-                error_message = f"No invitation found for barcode: {barcode_number}"
+            invitations = Invitation.objects.select_related('guest', 'event')
+            pk = decode_barcode(barcode_number)
+            if pk is not None:
+                # Rows with a stored legacy number never use the primary-key barcode
+                invitation = invitations.filter(pk=pk, barcode_number__isnull=True).first()
+            if invitation is None and is_legacy_barcode(barcode_number):
+                invitation = invitations.filter(barcode_number=barcode_number).first()
+            
+            if invitation is None:
+                if pk is None and not is_legacy_barcode(barcode_number):
+                    error_message = f"Invalid barcode: {barcode_number}. Please scan again."
+                else:
+                    error_message = f"No invitation found for barcode: {barcode_number}"
     
     return render(request, 'guests/scan_barcode.html', {
         'invitation': invitation,
@@ -411,13 +482,16 @@ def resend_invitation(request, invitation_id):
     
     if request.method == 'POST':
         logger.info(f"User {request.user.username} resending invitation {invitation.id}")
-        send_invitation_email(invitation, request)
-        invitation.email_sent = True
-        invitation.email_sent_at = timezone.now()
-        invitation.status = 'sent'
-        invitation.save(update_fields=['email_sent', 'email_sent_at', 'status'])
+        job = queue_invitation_emails(
+            invitation.event, Invitation.objects.filter(pk=invitation.pk), request.user, request
+        )
         
-        messages.success(request, f'Invitation resent to {invitation.guest.full_name}!')
+        if job:
+            messages.success(request, f'Invitation to {invitation.guest.full_name} queued for resending!')
+        else:
+            # Addresses that bounced are suppressed
+            messages.warning(request, f'Invitation to {invitation.guest.full_name} was not queued: '
+                                      f'their email address has bounced.')
         
         # Redirect back to event dashboard or referrer
         next_url = request.POST.get('next', None)
@@ -433,31 +507,14 @@ def bulk_resend_invitations(request, event_id):
     event = get_object_or_404(Event, id=event_id, created_by=request.user)
     
     if request.method == 'POST':
-        # Get all invitations for the event
-        invitations = event.invitations.all()
-        
-        success_count = 0
-        error_count = 0
-        
-        for invitation in invitations:
-            try:
-                send_invitation_email(invitation, request)
-                invitation.email_sent = True
-                invitation.email_sent_at = timezone.now()
-                invitation.status = 'sent'
-                invitation.save(update_fields=['email_sent', 'email_sent_at', 'status'])
-                success_count += 1
-                logger.info(f"Bulk resend: Invitation {invitation.id} sent to {invitation.guest.email}")
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Bulk resend: Failed to send invitation {invitation.id} to {invitation.guest.email}: {str(e)}")
+        # Queue all invitations for the event
+        job = queue_invitation_emails(event, event.invitations.all(), request.user, request)
         
-        if success_count > 0:
-            messages.success(request, f'Successfully sent {success_count} invitation email(s)!')
-        if error_count > 0:
-            messages.warning(request, f'Failed to send {error_count} invitation email(s). Please check the logs.')
-        
-        logger.info(f"User {request.user.username} bulk resent {success_count} invitations for event {event.id}")
+        if job:
+            messages.success(request, f'{job.total} invitation email(s) queued for sending. Progress is shown below.')
+            logger.info(f"User {request.user.username} queued {job.total} invitations for event {event.id}")
+        else:
+            messages.warning(request, 'No invitations to send: the event has none, or every guest\'s email has bounced.')
         
         return redirect('event_dashboard', event_id=event.id)
     